@@ -0,0 +1,153 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.template.response import SimpleTemplateResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAcceptable
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .timing import render_timer
+
+
+class AsyncReadMixin:
+    """
+    Асинхронные действия чтения для ASGI-сервера.
+
+    Если включена настройка ASYNC_READ_VIEWS, GET и HEAD для
+    async_actions обрабатываются корутинами alist и aretrieve
+    с асинхронным ORM, и медленный ответ БД не занимает поток.
+    Остальные методы и ответы не в JSON (браузерный API) отдаёт
+    обычный синхронный ViewSet, поэтому ответы не меняются.
+    """
+    async_actions = ("list", "retrieve")
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if (not settings.ASYNC_READ_VIEWS
+                or actions.get("get") not in cls.async_actions):
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method in ("GET", "HEAD"):
+                self = cls(**initkwargs)
+                if "get" in actions and "head" not in actions:
+                    actions["head"] = actions["get"]
+                self.action_map = actions
+                for method, action in actions.items():
+                    setattr(self, method, getattr(self, action))
+                self.request = request
+                response = await self.adispatch(request, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_view(request, *args, **kwargs)
+
+        async_view.cls = cls
+        async_view.initkwargs = view.initkwargs
+        async_view.actions = actions
+        return csrf_exempt(async_view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """
+        dispatch для корутин. Возвращает None, если запрос должен
+        обработать синхронный dispatch.
+        """
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+
+        try:
+            renderer, _ = self.perform_content_negotiation(request)
+        except NotAcceptable:
+            return None
+        if not isinstance(renderer, JSONRenderer):
+            return None
+
+        try:
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+            handler = getattr(self, f"a{self.action}")
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response,
+                                               *args, **kwargs)
+        return self.rendered(self.response)
+
+    async def aperform_authentication(self, request):
+        """
+        Аутентификация как в Request.user, но без блокировки цикла
+        событий. Классы без aauthenticate вызываются в потоке.
+        """
+        for authenticator in request.authenticators:
+            authenticate = getattr(authenticator, "aauthenticate", None)
+            if authenticate is None:
+                authenticate = sync_to_async(authenticator.authenticate)
+            try:
+                user_auth_tuple = await authenticate(request)
+            except APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    @staticmethod
+    def rendered(response):
+        """
+        Рендерит ответ DRF сразу: отложенный рендеринг Django
+        выполнил бы в отдельном потоке
+        """
+        if not isinstance(response, SimpleTemplateResponse):
+            return response
+        with render_timer():
+            response.render()
+        rendered = HttpResponse(response.content,
+                                status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            [instance async for instance in queryset], many=True
+        )
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        try:
+            instance = await aget_object_or_404(queryset, **filter_kwargs)
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(
+            queryset, self.request, view=self
+        )
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router
+from rest_framework.authentication import (TokenAuthentication,
+                                           get_authorization_header)
+from rest_framework.authtoken.models import Token
+
+from recipes.counters import COUNTERS
+
+Entry = namedtuple("Entry", ("user_id", "data", "expires_at"))
+
+# Не кэшируются хеш пароля и счётчики: при обращении они загрузятся
+# из БД, а save() пользователя не запишет устаревшие значения
+EXCLUDED_FIELDS = {"password"} | {
+    counter.counter_field for counter in COUNTERS
+    if counter.target == "FoodgramUser"
+}
+
+
+class TokenUserCache:
+    """
+    Кэш token -> пользователь в памяти процесса (LRU с TTL).
+
+    Если задан TOKEN_CACHE_ALIAS, записи дублируются в общем кэше
+    Django, и другие процессы берут их оттуда. Удаление записи
+    в одном процессе остальные процессы увидят не позже TTL.
+
+    Хранятся не сами объекты, а значения полей: каждый запрос получает
+    собственный экземпляр пользователя и может его менять.
+    """
+
+    def __init__(self, maxsize, ttl, alias=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.alias = alias
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    @staticmethod
+    def shared_key(key):
+        return f"auth-token:{key}"
+
+    def get(self, key):
+        """Пара (user, token) из кэша или None"""
+        found = self._get_local(key)
+        if found is None:
+            data = (self.shared.get(self.shared_key(key))
+                    if self.shared else None)
+            found = self._found_shared(key, data)
+        return found
+
+    async def aget(self, key):
+        found = self._get_local(key)
+        if found is None:
+            data = (await self.shared.aget(self.shared_key(key))
+                    if self.shared else None)
+            found = self._found_shared(key, data)
+        return found
+
+    def _get_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._items[key]
+                entry = None
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        return self.build(key, entry.data)
+
+    def _found_shared(self, key, data):
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, data)
+        return self.build(key, data)
+
+    def set(self, key, user, token):
+        fields = [field.attname for field in user._meta.concrete_fields
+                  if field.attname not in EXCLUDED_FIELDS]
+        data = (user.pk, fields,
+                [getattr(user, field) for field in fields], token.created)
+        with self._lock:
+            self._store(key, data)
+        if self.shared:
+            self.shared.set(self.shared_key(key), data, timeout=self.ttl)
+
+    def _store(self, key, data):
+        self._items[key] = Entry(data[0], data, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    @staticmethod
+    def build(key, data):
+        user_id, fields, values, created = data
+        model = get_user_model()
+        user = model.from_db(router.db_for_read(model), fields, values)
+        token = Token.from_db(router.db_for_read(Token),
+                              ["key", "user_id", "created"],
+                              [key, user_id, created])
+        token.user = user
+        return user, token
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+        if self.shared:
+            self.shared.delete(self.shared_key(key))
+
+    def invalidate_user(self, user_id):
+        """Удаляет записи всех токенов пользователя"""
+        with self._lock:
+            for key in [key for key, entry in self._items.items()
+                        if entry.user_id == user_id]:
+                del self._items[key]
+        if self.shared:
+            keys = Token.objects.filter(user_id=user_id).values_list(
+                "key", flat=True
+            )
+            self.shared.delete_many([self.shared_key(key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Счётчики попаданий и промахов этого процесса"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._items),
+        }
+
+
+token_cache = TokenUserCache(
+    maxsize=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, запоминающая пользователя токена в token_cache
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
+
+    async def aauthenticate(self, request):
+        """
+        Асинхронный authenticate: токен из кэша проверяется без
+        обращения к БД, остальные случаи - синхронным authenticate
+        в отдельном потоке
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 2:
+            try:
+                cached = await token_cache.aget(auth[1].decode())
+            except UnicodeError:
+                cached = None
+            if cached is not None:
+                return cached
+        return await sync_to_async(self.authenticate)(request)
@@ -0,0 +1,198 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+# Заголовки ответа, которые хранятся вместе с данными
+CACHED_HEADERS = ("ETag", "Last-Modified")
+
+
+class ResponseCache:
+    """
+    Кэш ответов API для анонимных GET-запросов.
+
+    Ключ записи включает номер версии, поэтому для сброса всех записей
+    достаточно увеличить версию (bump). Старые записи удаляются
+    бэкендом кэша по таймауту.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[settings.RESPONSE_CACHE_ALIAS]
+
+    @property
+    def version_key(self):
+        return f"{self.prefix}:version"
+
+    def is_cacheable(self, request):
+        return (settings.RESPONSE_CACHE_ENABLED
+                and request.method == "GET"
+                and not request.user.is_authenticated)
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, 1, timeout=None)
+            version = self.cache.get(self.version_key, 1)
+        return version
+
+    async def aget_version(self):
+        version = await self.cache.aget(self.version_key)
+        if version is None:
+            await self.cache.aadd(self.version_key, 1, timeout=None)
+            version = await self.cache.aget(self.version_key, 1)
+        return version
+
+    def bump(self):
+        """Сбрасывает все записи этого кэша"""
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.set(self.version_key, 1, timeout=None)
+
+    def make_key(self, request, version):
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        raw = f"{request.path}?{params}"
+        digest = hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+        # r2: записи вместе с заголовками, старые записи без них
+        # не читаются
+        return f"{self.prefix}:r2:{version}:{digest}"
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self.count("hits" if data is not None else "misses")
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+
+    async def aget(self, key):
+        data = await self.cache.aget(key)
+        await self.acount("hits" if data is not None else "misses")
+        return data
+
+    async def aset(self, key, data):
+        await self.cache.aset(key, data,
+                              timeout=settings.RESPONSE_CACHE_TIMEOUT)
+
+    def count(self, counter):
+        key = f"{self.prefix}:{counter}"
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 1, timeout=None)
+
+    async def acount(self, counter):
+        key = f"{self.prefix}:{counter}"
+        try:
+            await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aadd(key, 1, timeout=None)
+
+    def stats(self):
+        """Счётчики попаданий и промахов"""
+        hits = self.cache.get(f"{self.prefix}:hits", 0)
+        misses = self.cache.get(f"{self.prefix}:misses", 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+recipe_response_cache = ResponseCache("recipes")
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Отдаёт list и retrieve анонимным пользователям из response_cache.
+
+    Вместе с данными хранятся ETag и Last-Modified ответа, поэтому
+    при попадании в кэш условный запрос проверяется без обращения
+    к БД. Миксин должен стоять перед ConditionalGetMixin.
+    """
+    response_cache = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request,
+                                           *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request,
+                                           *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.response_cache.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        key = self.response_cache.make_key(
+            request, self.response_cache.get_version()
+        )
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            return self.cached_hit(request, *entry)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.response_cache.set(key, (response.data, {
+                header: response[header]
+                for header in CACHED_HEADERS if header in response
+            }))
+        response["X-Cache"] = "MISS"
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if not self.response_cache.is_cacheable(request):
+            return await handler(request, *args, **kwargs)
+
+        key = self.response_cache.make_key(
+            request, await self.response_cache.aget_version()
+        )
+        entry = await self.response_cache.aget(key)
+        if entry is not None:
+            return self.cached_hit(request, *entry)
+
+        response = await handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            await self.response_cache.aset(key, (response.data, {
+                header: response[header]
+                for header in CACHED_HEADERS if header in response
+            }))
+        response["X-Cache"] = "MISS"
+        return response
+
+    @staticmethod
+    def cached_hit(request, data, headers):
+        """
+        Ответ из кэша или 304, если у клиента та же версия
+        """
+        last_modified = headers.get("Last-Modified")
+        response = get_conditional_response(
+            request, etag=headers.get("ETag"),
+            last_modified=(parse_http_date_safe(last_modified)
+                           if last_modified else None),
+        )
+        if response is None:
+            response = Response(data)
+        for header, value in headers.items():
+            response[header] = value
+        response["X-Cache"] = "HIT"
+        return response
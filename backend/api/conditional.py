@@ -0,0 +1,93 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list и retrieve: ETag и Last-Modified
+    считаются методом get_validators до сериализации, и если клиент
+    прислал актуальные If-None-Match/If-Modified-Since, сразу
+    отдаётся 304.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request,
+                                         *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request,
+                                         *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aconditional_response(super().alist, request,
+                                                *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aconditional_response(super().aretrieve, request,
+                                                *args, **kwargs)
+
+    def get_validators(self, request, *args, **kwargs):
+        """
+        Возвращает (данные для ETag, дата изменения) или (None, None)
+        """
+        raise NotImplementedError
+
+    async def aget_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return handler(request, *args, **kwargs)
+
+        state, last_modified = self.get_validators(request, *args, **kwargs)
+        if state is None:
+            return handler(request, *args, **kwargs)
+
+        etag, timestamp, response = self.check_validators(
+            request, state, last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return self.set_validators(response, etag, timestamp)
+
+    async def aconditional_response(self, handler, request, *args,
+                                    **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return await handler(request, *args, **kwargs)
+
+        state, last_modified = await self.aget_validators(request, *args,
+                                                          **kwargs)
+        if state is None:
+            return await handler(request, *args, **kwargs)
+
+        etag, timestamp, response = self.check_validators(
+            request, state, last_modified
+        )
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+        return self.set_validators(response, etag, timestamp)
+
+    @staticmethod
+    def check_validators(request, state, last_modified):
+        """
+        ETag, дата изменения и ответ 304, если у клиента актуальная копия
+        """
+        etag = quote_etag(hashlib.md5(
+            str(state).encode(), usedforsecurity=False
+        ).hexdigest())
+        timestamp = (int(last_modified.timestamp())
+                     if last_modified else None)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        return etag, timestamp, response
+
+    @staticmethod
+    def set_validators(response, etag, timestamp):
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            if timestamp is not None:
+                response["Last-Modified"] = http_date(timestamp)
+        return response
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from recipes.models import FoodgramUser, Ingredient, Recipe
+
+HOST = "localhost"
+MODES = {
+    "wsgi": "синхронные представления, WSGI",
+    "asgi": "асинхронные представления, ASGI",
+}
+
+
+def get_urls():
+    """
+    Адреса эндпоинтов чтения, у которых есть асинхронные варианты
+    """
+    recipe_id = Recipe.objects.order_by("-id").values_list(
+        "id", flat=True
+    ).first()
+    name = Ingredient.objects.values_list("name", flat=True).first() or ""
+    return (
+        "/api/recipes/",
+        "/api/recipes/?page=2&limit=20",
+        "/api/recipes/?cursor=&limit=20",
+        f"/api/recipes/{recipe_id}/",
+        f"/api/ingredients/?name={quote(name[:2])}",
+        f"/s/{recipe_id}/",
+    )
+
+
+class Command(BaseCommand):
+    help = ("Пропускная способность и задержки эндпоинтов чтения: "
+            "синхронные представления под WSGI против асинхронных "
+            "под ASGI. Каждый режим запускается в отдельном процессе.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000,
+                            help="Всего запросов в каждом режиме")
+        parser.add_argument("--concurrency", type=int, default=200,
+                            help="Одновременных клиентов")
+        parser.add_argument("--workers", type=int, default=2,
+                            help="Синхронных воркеров, как gunicorn -w")
+        parser.add_argument(
+            "--db-latency", type=float, nargs="+", default=[2.0, 20.0],
+            help="Задержка каждого SQL-запроса в мс, имитирующая "
+                 "сетевую БД. Каждое значение - отдельный прогон."
+        )
+        parser.add_argument("--mode", choices=MODES,
+                            help=argparse.SUPPRESS)
+        parser.add_argument("--token", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options["mode"]:
+            self.stdout.write(json.dumps(self.run_mode(options["mode"])))
+            return
+
+        if not Recipe.objects.exists():
+            raise CommandError("В базе нет рецептов, сначала запустите "
+                               "python manage.py seed_perf_data")
+        author = FoodgramUser.objects.annotate(
+            total=Count("recipes")
+        ).order_by("-total").first()
+        token, _ = Token.objects.get_or_create(user=author)
+
+        self.stdout.write(
+            f"{'БД, мс':>6}  {'режим':<34} {'запросов/с':>10} "
+            f"{'p50, мс':>9} {'p99, мс':>9}"
+        )
+        differ = set()
+        for latency in options["db_latency"]:
+            results = {mode: self.run_child(mode, token.key, latency)
+                       for mode in MODES}
+            for mode, title in MODES.items():
+                result = results[mode]
+                self.stdout.write(
+                    f"{latency:>6g}  {title:<34} "
+                    f"{result['throughput']:>10.0f} "
+                    f"{result['p50']:>9.1f} {result['p99']:>9.1f}"
+                )
+            differ.update(
+                url for url, digest in results["wsgi"]["digests"].items()
+                if results["asgi"]["digests"].get(url) != digest
+            )
+
+        if differ:
+            raise CommandError(
+                f"Ответы различаются: {', '.join(sorted(differ))}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Ответы обоих режимов совпадают побайтно"
+        ))
+
+    def run_child(self, mode, token, latency):
+        """
+        Запускает режим в новом процессе: выбор представлений
+        по ASYNC_READ_VIEWS происходит при загрузке URLconf
+        """
+        options = self.options
+        command = [
+            sys.executable, str(settings.BASE_DIR / "manage.py"),
+            "benchmark_async_reads", "--mode", mode, "--token", token,
+            "--requests", str(options["requests"]),
+            "--concurrency", str(options["concurrency"]),
+            "--workers", str(options["workers"]),
+            "--db-latency", str(latency),
+        ]
+        env = dict(os.environ, ASYNC_READ_VIEWS=str(mode == "asgi"),
+                   RESPONSE_CACHE_ENABLED="False", ALLOWED_HOSTS=HOST)
+        child = subprocess.run(command, env=env, capture_output=True,
+                               text=True)
+        if child.returncode:
+            raise CommandError(f"{MODES[mode]}: {child.stderr}")
+        return json.loads(child.stdout.splitlines()[-1])
+
+    def run_mode(self, mode):
+        options = self.options
+        latency = options["db_latency"][0]
+        if latency:
+            self.add_db_latency(latency / 1000)
+
+        jobs = [
+            (url, token)
+            for url in get_urls()
+            for token in (None, options["token"])
+        ]
+        self.digests = {}
+        started = time.perf_counter()
+        if mode == "wsgi":
+            latencies = self.run_wsgi(jobs)
+        else:
+            latencies = asyncio.run(self.run_asgi(jobs))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "throughput": len(latencies) / elapsed,
+            "p50": statistics.median(latencies) * 1000,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+            "digests": self.digests,
+        }
+
+    @staticmethod
+    def add_db_latency(latency):
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            # Сигнал приходит при каждом переподключении того же объекта
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        connection_created.connect(install, weak=False)
+
+    def record(self, job, status, headers, body):
+        """
+        Запоминает отпечаток первого ответа на каждый запрос
+        """
+        url, token = job
+        key = f"{url} ({'токен' if token else 'аноним'})"
+        if key not in self.digests:
+            raw = json.dumps([status, sorted(headers)]).encode() + body
+            self.digests[key] = hashlib.sha1(raw).hexdigest()
+
+    def run_wsgi(self, jobs):
+        """
+        Закрытая нагрузка: concurrency клиентов отправляют следующий
+        запрос сразу после ответа, запросы обрабатывают workers потоков
+        """
+        handler = WSGIHandler()
+        total = self.options["requests"]
+        workers = self.options["workers"]
+        pending = queue.Queue()
+        lock = threading.Lock()
+        latencies = []
+        issued = min(self.options["concurrency"], total)
+        for number in range(issued):
+            pending.put((number, time.perf_counter()))
+
+        def worker():
+            nonlocal issued
+            while (item := pending.get()) is not None:
+                number, started = item
+                job = jobs[number % len(jobs)]
+                self.record(job, *self.call_wsgi(handler, job))
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    if issued < total:
+                        pending.put((issued, time.perf_counter()))
+                        issued += 1
+                    elif len(latencies) == total:
+                        for _ in range(workers):
+                            pending.put(None)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies
+
+    async def run_asgi(self, jobs):
+        """
+        Та же нагрузка для одного ASGI-процесса
+        """
+        application = ASGIHandler()
+        total = self.options["requests"]
+        numbers = itertools.count()
+        latencies = []
+
+        async def client():
+            while (number := next(numbers)) < total:
+                job = jobs[number % len(jobs)]
+                started = time.perf_counter()
+                self.record(job, *await self.call_asgi(application, job))
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(client()
+                               for _ in range(self.options["concurrency"])))
+        return latencies
+
+    @staticmethod
+    def call_wsgi(handler, job):
+        url, token = job
+        path, _, query = url.partition("?")
+        environ = {
+            "REQUEST_METHOD": "GET", "PATH_INFO": path,
+            "QUERY_STRING": query, "SERVER_NAME": HOST,
+            "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": HOST, "REMOTE_ADDR": "127.0.0.1",
+            "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(),
+            "wsgi.errors": sys.stderr, "wsgi.multithread": True,
+            "wsgi.multiprocess": False, "wsgi.run_once": False,
+        }
+        if token:
+            environ["HTTP_AUTHORIZATION"] = f"Token {token}"
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result["status"] = int(status.split()[0])
+            result["headers"] = [(name.lower(), value)
+                                 for name, value in headers]
+
+        response = handler(environ, start_response)
+        body = b"".join(response)
+        response.close()
+        return result["status"], result["headers"], body
+
+    @staticmethod
+    async def call_asgi(application, job):
+        url, token = job
+        path, _, query = url.partition("?")
+        headers = [(b"host", HOST.encode())]
+        if token:
+            headers.append((b"authorization", f"Token {token}".encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"},
+            "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "headers": headers,
+            "client": ("127.0.0.1", 0), "server": (HOST, 80),
+        }
+        received = asyncio.Event()
+        result = {"body": b""}
+
+        async def receive():
+            if received.is_set():
+                # Клиент не отключается: ждём, пока Django отменит задачу
+                await asyncio.Future()
+            received.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                result["status"] = message["status"]
+                result["headers"] = [(name.decode().lower(), value.decode())
+                                     for name, value in message["headers"]]
+            elif message["type"] == "http.response.body":
+                result["body"] += message.get("body", b"")
+
+        await application(scope, receive, send)
+        return result["status"], result["headers"], result["body"]
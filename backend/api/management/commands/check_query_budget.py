@@ -0,0 +1,504 @@
+import json
+import random
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import CachedTokenAuthentication, token_cache
+from recipes import feed
+from recipes.ingredient_index import ingredient_index
+from recipes.pantry_index import pantry_index
+from recipes.models import (FoodgramUser, Ingredient, Recipe,
+                            RecipeIngredient, Favourite, ShoppingCart,
+                            Subscriber)
+
+PASSWORD = "budget-Pa55word"
+PNG = ("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ"
+       "AAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==")
+
+# Бюджет запросов к БД: (имя маршрута, метод, кто) -> число запросов.
+# Запрос авторизованного пользователя включает поиск токена.
+BUDGETS = {
+    ("api:api-root", "GET", "anon"): 0,
+    ("api:login", "POST", "anon"): 3,
+    ("api:logout", "POST", "other"): 2,
+    ("api:ingredients-list", "GET", "anon"): 1,
+    ("api:ingredients-list", "GET", "user"): 1,
+    ("api:ingredients-detail", "GET", "anon"): 1,
+    ("api:ingredients-detail", "GET", "user"): 1,
+    ("api:recipes-list", "GET", "anon"): 4,
+    ("api:recipes-list", "GET", "user"): 5,
+    ("api:recipes-list", "POST", "user"): 11,
+    ("api:recipes-detail", "GET", "anon"): 3,
+    ("api:recipes-detail", "GET", "user"): 3,
+    ("api:recipes-detail", "PATCH", "user"): 12,
+    ("api:recipes-detail", "DELETE", "user"): 9,
+    ("api:recipes-get-link", "GET", "anon"): 1,
+    ("api:recipes-get-link", "GET", "user"): 1,
+    ("api:recipes-favorite", "POST", "user"): 6,
+    ("api:recipes-favorite", "DELETE", "user"): 4,
+    ("api:recipes-shopping-cart", "POST", "user"): 5,
+    ("api:recipes-shopping-cart", "DELETE", "user"): 3,
+    ("api:recipes-download-shopping-cart", "GET", "user"): 2,
+    ("api:recipes-can-cook", "GET", "anon"): 2,
+    ("api:recipes-can-cook", "GET", "user"): 2,
+    ("api:recipes-feed", "GET", "user"): 4,
+    ("api:users-list", "GET", "anon"): 2,
+    ("api:users-list", "GET", "user"): 2,
+    ("api:users-list", "POST", "anon"): 5,
+    ("api:users-detail", "GET", "anon"): 1,
+    ("api:users-detail", "GET", "user"): 1,
+    ("api:users-me", "GET", "user"): 1,
+    ("api:users-set-password", "POST", "user"): 4,
+    ("api:users-avatar", "PUT", "user"): 3,
+    ("api:users-avatar", "DELETE", "user"): 3,
+    ("api:users-subscribe", "POST", "user"): 10,
+    ("api:users-subscribe", "DELETE", "user"): 6,
+    ("api:users-subscriptions", "GET", "user"): 3,
+    ("recipes:short-link-redirect", "GET", "anon"): 1,
+}
+
+# Маршруты, число запросов которых пока растёт вместе с объёмом данных:
+# они выводятся в отчёте, но не проверяются.
+UNBOUNDED = set()
+
+# Маршруты djoser, которые проект не использует (письма отключены).
+SKIPPED_ROUTES = {
+    "api:users-activation",
+    "api:users-resend-activation",
+    "api:users-reset-password",
+    "api:users-reset-password-confirm",
+    "api:users-reset-username",
+    "api:users-reset-username-confirm",
+    "api:users-set-username",
+}
+
+Scenario = namedtuple("Scenario", ("name", "method", "url", "auth", "data"),
+                      defaults=(None,))
+
+SCENARIOS = (
+    Scenario("api root", "GET", "/api/", "anon"),
+    Scenario("ingredients", "GET", "/api/ingredients/", "anon"),
+    Scenario("ingredients", "GET", "/api/ingredients/", "user"),
+    Scenario("ingredients search", "GET",
+             "/api/ingredients/?name={ingredient_prefix}", "user"),
+    Scenario("ingredient", "GET", "/api/ingredients/{ingredient_id}/",
+             "anon"),
+    Scenario("ingredient", "GET", "/api/ingredients/{ingredient_id}/",
+             "user"),
+    Scenario("recipes", "GET", "/api/recipes/", "anon"),
+    Scenario("recipes", "GET", "/api/recipes/", "user"),
+    Scenario("recipes big page", "GET", "/api/recipes/?limit=100", "anon"),
+    Scenario("recipes big page", "GET", "/api/recipes/?limit=100", "user"),
+    Scenario("recipes deep page", "GET", "/api/recipes/?page=3", "user"),
+    Scenario("recipes cursor", "GET", "/api/recipes/?cursor=&limit=100",
+             "anon"),
+    Scenario("recipes cursor", "GET", "/api/recipes/?cursor=&limit=100",
+             "user"),
+    Scenario("recipes by author", "GET",
+             "/api/recipes/?author={author_id}&limit=100", "user"),
+    Scenario("recipes search", "GET",
+             "/api/recipes/?search=рецепт&limit=100", "anon"),
+    Scenario("recipes search", "GET",
+             "/api/recipes/?search=рецепт&limit=100", "user"),
+    Scenario("recipes search cursor", "GET",
+             "/api/recipes/?search=рецепт&cursor=&limit=100", "user"),
+    Scenario("recipes favorited", "GET",
+             "/api/recipes/?is_favorited=1&limit=100", "user"),
+    Scenario("recipes in cart", "GET",
+             "/api/recipes/?is_in_shopping_cart=1&limit=100", "user"),
+    Scenario("can cook", "GET",
+             "/api/recipes/can_cook/?ingredients={pantry}&missing=2"
+             "&limit=100", "anon"),
+    Scenario("can cook", "GET",
+             "/api/recipes/can_cook/?ingredients={pantry}&missing=2"
+             "&limit=100", "user"),
+    Scenario("feed", "GET", "/api/recipes/feed/?limit=100", "user"),
+    Scenario("recipe", "GET", "/api/recipes/{recipe_id}/", "anon"),
+    Scenario("recipe", "GET", "/api/recipes/{recipe_id}/", "user"),
+    Scenario("short link", "GET", "/api/recipes/{recipe_id}/get-link/",
+             "anon"),
+    Scenario("short link", "GET", "/api/recipes/{recipe_id}/get-link/",
+             "user"),
+    Scenario("short link redirect", "GET", "/s/{recipe_id}/", "anon"),
+    Scenario("create recipe", "POST", "/api/recipes/", "user",
+             "recipe_create"),
+    Scenario("update recipe", "PATCH", "/api/recipes/{own_recipe_id}/",
+             "user", "recipe_update"),
+    Scenario("delete recipe", "DELETE",
+             "/api/recipes/{disposable_recipe_id}/", "user"),
+    Scenario("add favourite", "POST", "/api/recipes/{recipe_id}/favorite/",
+             "user"),
+    Scenario("remove favourite", "DELETE",
+             "/api/recipes/{recipe_id}/favorite/", "user"),
+    Scenario("add to cart", "POST",
+             "/api/recipes/{recipe_id}/shopping_cart/", "user"),
+    Scenario("remove from cart", "DELETE",
+             "/api/recipes/{recipe_id}/shopping_cart/", "user"),
+    Scenario("download cart", "GET", "/api/recipes/download_shopping_cart/",
+             "user"),
+    Scenario("users", "GET", "/api/users/", "anon"),
+    Scenario("users", "GET", "/api/users/", "user"),
+    Scenario("users big page", "GET", "/api/users/?limit=100", "user"),
+    Scenario("register", "POST", "/api/users/", "anon", "register"),
+    Scenario("profile", "GET", "/api/users/{author_id}/", "anon"),
+    Scenario("profile", "GET", "/api/users/{author_id}/", "user"),
+    Scenario("me", "GET", "/api/users/me/", "user"),
+    Scenario("set avatar", "PUT", "/api/users/me/avatar/", "user",
+             "avatar"),
+    Scenario("delete avatar", "DELETE", "/api/users/me/avatar/", "user"),
+    Scenario("set password", "POST", "/api/users/set_password/", "user",
+             "set_password"),
+    Scenario("subscribe", "POST", "/api/users/{stranger_id}/subscribe/",
+             "user"),
+    Scenario("unsubscribe", "DELETE",
+             "/api/users/{stranger_id}/subscribe/", "user"),
+    Scenario("subscriptions", "GET", "/api/users/subscriptions/", "user"),
+    Scenario("subscriptions big page", "GET",
+             "/api/users/subscriptions/?limit=100&recipes_limit=3", "user"),
+    Scenario("subscriptions cursor", "GET",
+             "/api/users/subscriptions/?cursor=&limit=100", "user"),
+    Scenario("login", "POST", "/api/auth/token/login/", "anon", "login"),
+    Scenario("logout", "POST", "/api/auth/token/logout/", "other"),
+)
+
+# Переменные коллекции Postman -> ключи контекста сценариев
+POSTMAN_VARIABLES = {
+    "baseUrl": "",
+    "userId": "{author_id}",
+    "secondUserId": "{author_id}",
+    "thirdUserId": "{stranger_id}",
+    "firstRecipeId": "{recipe_id}",
+    "secondRecipeId": "{recipe_id}",
+    "thirdRecipeId": "{recipe_id}",
+    "fourthRecipeId": "{recipe_id}",
+    "fifthRecipeId": "{recipe_id}",
+    "firstIndredientId": "{ingredient_id}",
+    "ingredientNameFirstLatter": "{ingredient_prefix}",
+}
+
+
+class Command(BaseCommand):
+    help = ("Проверка числа SQL-запросов на каждый эндпоинт API. "
+            "Данные создаются внутри транзакции и откатываются, кэши "
+            "на время проверки заменяются локальными.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=30)
+        parser.add_argument("--recipes", type=int, default=120)
+        parser.add_argument("--ingredients", type=int, default=60)
+        parser.add_argument(
+            "--postman", metavar="PATH",
+            help="Коллекция Postman, GET-запросы которой добавляются "
+                 "к сценариям"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options["seed"])
+        self.password_hash = make_password(PASSWORD)
+        scenarios = list(SCENARIOS)
+        if options["postman"]:
+            scenarios.extend(self.load_postman(options["postman"]))
+
+        storages = {
+            "default": {
+                "BACKEND": "django.core.files.storage.InMemoryStorage"
+            },
+            "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage."
+                           "StaticFilesStorage"
+            },
+        }
+        # Сброс и перестройка индексов не должны дойти до общих кэшей
+        # работающих процессов
+        local_caches = {
+            alias: {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": f"query-budget-{alias}",
+            }
+            for alias in settings.CACHES
+        }
+        with override_settings(ALLOWED_HOSTS=["testserver"],
+                               STORAGES=storages,
+                               CACHES=local_caches,
+                               RESPONSE_CACHE_ENABLED=False,
+                               REQUEST_TIMING_ENABLED=False):
+            with transaction.atomic():
+                try:
+                    failures = self.run_budget(scenarios)
+                finally:
+                    transaction.set_rollback(True)
+                    token_cache.clear()
+
+        if failures:
+            raise CommandError(
+                f"Превышен бюджет запросов: {len(failures)}"
+            )
+        self.stdout.write(self.style.SUCCESS("Бюджет запросов соблюдён"))
+
+    def run_budget(self, scenarios):
+        """
+        Прогоняет сценарии дважды: второй раз после удвоения данных.
+        Число запросов не должно расти.
+        """
+        context = self.seed(0)
+        first = self.run_pass(scenarios, context, 0)
+        context = self.seed(1)
+        second = self.run_pass(scenarios, context, 1)
+
+        failures = []
+        for key, count in second.items():
+            view_name, method, auth = key[1:]
+            budget = BUDGETS.get((view_name, method, auth))
+            problem = None
+            if view_name in UNBOUNDED:
+                self.stdout.write(self.style.WARNING(
+                    f"{key[0]:<30} {method:<6} {auth:<5} {count:>3}  "
+                    f"без бюджета ({first[key]} -> {count})"
+                ))
+                continue
+            if budget is None:
+                problem = "нет бюджета"
+            elif count > budget:
+                problem = f"бюджет {budget}"
+            elif count > first[key]:
+                problem = f"растёт с данными ({first[key]} -> {count})"
+            line = f"{key[0]:<30} {method:<6} {auth:<5} {count:>3}"
+            if problem:
+                failures.append(key)
+                self.stdout.write(self.style.ERROR(f"{line}  {problem}"))
+            else:
+                self.stdout.write(line)
+
+        covered = {key[1] for key in second}
+        for view_name in sorted(self.api_routes() - covered):
+            self.stdout.write(self.style.WARNING(
+                f"Маршрут без сценария: {view_name}"
+            ))
+        return failures
+
+    def run_pass(self, scenarios, context, number):
+        """
+        Выполняет сценарии и считает запросы к БД для каждого
+        """
+        tokens = {
+            auth: Token.objects.get_or_create(user=context[auth])[0].key
+            for auth in ("user", "other")
+        }
+        clients = {"anon": APIClient()}
+        for auth, key in tokens.items():
+            clients[auth] = APIClient()
+            clients[auth].credentials(HTTP_AUTHORIZATION=f"Token {key}")
+        counts = {}
+        for scenario in scenarios:
+            url = scenario.url.format(**context)
+            data = (self.payload(scenario.data, context, number)
+                    if scenario.data else None)
+            client = clients[scenario.auth]
+            if scenario.auth in tokens:
+                # Бюджет считается для уже прогретого кэша токенов
+                CachedTokenAuthentication().authenticate_credentials(
+                    tokens[scenario.auth]
+                )
+            with CaptureQueriesContext(connection) as queries:
+                response = client.generic(
+                    scenario.method, url,
+                    json.dumps(data) if data is not None else "",
+                    content_type="application/json",
+                )
+                if response.streaming:
+                    b"".join(response.streaming_content)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f"{scenario.name}: {scenario.method} {url} -> "
+                    f"{response.status_code} {response.content[:200]}"
+                )
+            view_name = resolve(urlsplit(url).path).view_name
+            key = (scenario.name, view_name, scenario.method, scenario.auth)
+            counts[key] = max(counts.get(key, 0), len(queries))
+        return counts
+
+    def payload(self, kind, context, number):
+        """
+        Тело запроса для сценариев, изменяющих данные
+        """
+        if kind == "recipe_create":
+            return {
+                "name": f"Бюджет {number}", "text": "Текст",
+                "cooking_time": 10, "image": PNG,
+                "ingredients": [{"id": pk, "amount": 2}
+                                for pk in context["ingredient_ids"][:12]],
+            }
+        if kind == "recipe_update":
+            return {
+                "name": f"Обновлённый {number}", "text": "Текст",
+                "cooking_time": 15, "image": PNG,
+                "ingredients": [{"id": pk, "amount": 3}
+                                for pk in context["ingredient_ids"][4:16]],
+            }
+        if kind == "register":
+            return {
+                "email": f"new{number}@budget.ru",
+                "username": f"new{number}", "first_name": "Новый",
+                "last_name": "Пользователь", "password": PASSWORD,
+            }
+        if kind == "avatar":
+            return {"avatar": PNG}
+        if kind == "set_password":
+            return {"new_password": PASSWORD,
+                    "current_password": PASSWORD}
+        if kind == "login":
+            return {"email": context["other"].email, "password": PASSWORD}
+        raise CommandError(f"Неизвестное тело запроса: {kind}")
+
+    def seed(self, number):
+        """
+        Создаёт очередную порцию данных и возвращает контекст сценариев
+        """
+        options = self.options
+        users = FoodgramUser.objects.bulk_create(
+            FoodgramUser(email=f"user{number}-{i}@budget.ru",
+                         username=f"user{number}-{i}",
+                         first_name="Имя", last_name=f"Фамилия {i}",
+                         password=self.password_hash)
+            for i in range(options["users"])
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"продукт {number}-{i}",
+                       measurement_unit=self.random.choice(("г", "мл", "шт")))
+            for i in range(options["ingredients"])
+        )
+        ingredient_index.invalidate()
+        token_cache.clear()
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=self.random.choice(users),
+                   name=f"Рецепт {number}-{i}", text="Текст рецепта",
+                   cooking_time=self.random.randint(1, 180),
+                   image="recipes/budget.png")
+            for i in range(options["recipes"])
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=self.random.randint(1, 500))
+            for recipe in recipes
+            for ingredient in self.random.sample(
+                ingredients, min(len(ingredients),
+                                 self.random.randint(3, 20)))
+        )
+        for model in (Favourite, ShoppingCart):
+            model.objects.bulk_create(
+                model(author=user, recipe=recipe)
+                for user in users
+                for recipe in self.random.sample(recipes,
+                                                 min(len(recipes), 10))
+            )
+
+        user, other, stranger = users[0], users[1], users[2]
+        authors = users[3:]
+        Subscriber.objects.bulk_create(
+            Subscriber(subscriber=subscriber, publisher=publisher)
+            for subscriber in users
+            for publisher in self.random.sample(authors,
+                                                min(len(authors), 8))
+            if subscriber != publisher
+        )
+        Subscriber.objects.filter(subscriber=user,
+                                  publisher=stranger).delete()
+        own_recipe, disposable = Recipe.objects.bulk_create([
+            Recipe(author=user, name=f"Свой {number}", text="Текст",
+                   cooking_time=5, image="recipes/budget.png"),
+            Recipe(author=user, name=f"Удаляемый {number}", text="Текст",
+                   cooking_time=5, image="recipes/budget.png"),
+        ])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in (own_recipe, disposable)
+            for ingredient in ingredients[:8]
+        )
+        # Бюджет считается для уже построенного индекса продуктов
+        pantry_index.invalidate(rebuild=True)
+        pantry_index.match([])
+        # Подписки и рецепты созданы без сигналов
+        feed.rebuild()
+        recipe = next(recipe for recipe in recipes
+                      if not recipe.favourites.filter(author=user).exists()
+                      and not recipe.shoppingcarts.filter(
+                          author=user).exists())
+
+        return {
+            "user": user,
+            "other": other,
+            "author_id": recipe.author_id,
+            "stranger_id": stranger.id,
+            "recipe_id": recipe.id,
+            "own_recipe_id": own_recipe.id,
+            "disposable_recipe_id": disposable.id,
+            "ingredient_id": ingredients[0].id,
+            "ingredient_ids": [ingredient.id for ingredient in ingredients],
+            "ingredient_prefix": "прод",
+            "pantry": ",".join(str(ingredient.id)
+                               for ingredient in ingredients[:20]),
+        }
+
+    @staticmethod
+    def load_postman(path):
+        """
+        Берёт GET-запросы из коллекции Postman в качестве сценариев
+        """
+        with open(path, encoding="utf-8") as f:
+            collection = json.load(f)
+
+        def walk(items):
+            for item in items:
+                if "bad_requests" in item["name"]:
+                    continue
+                if "item" in item:
+                    yield from walk(item["item"])
+                else:
+                    yield item
+
+        scenarios = []
+        for item in walk(collection["item"]):
+            request = item["request"]
+            url = request["url"]
+            raw = url["raw"] if isinstance(url, dict) else url
+            if request["method"] != "GET" or "9876" in raw:
+                continue
+            for variable, value in POSTMAN_VARIABLES.items():
+                raw = raw.replace(f"{{{{{variable}}}}}", value)
+            if "{{" in raw:
+                continue
+            auth = "anon" if "No Auth" in item["name"] else "user"
+            scenarios.append(Scenario(f"postman: {item['name'][:22]}",
+                                      "GET", raw, auth))
+        return scenarios
+
+    @staticmethod
+    def api_routes():
+        """
+        Имена всех маршрутов API и короткой ссылки
+        """
+        names = set()
+
+        def walk(patterns, namespace):
+            for pattern in patterns:
+                if isinstance(pattern, URLResolver):
+                    walk(pattern.url_patterns,
+                         pattern.namespace or namespace)
+                elif isinstance(pattern, URLPattern) and pattern.name:
+                    names.add(f"{namespace}:{pattern.name}")
+
+        walk(get_resolver().url_patterns, None)
+        return {name for name in names
+                if name.split(":")[0] in ("api", "recipes")
+                and name not in SKIPPED_ROUTES}
@@ -0,0 +1,84 @@
+import io
+import pstats
+import statistics
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import saved_profiles
+
+SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+
+class Command(BaseCommand):
+    help = ("Профили запросов из PROFILE_DIR: список, сводка по "
+            "представлениям и самые затратные функции всех профилей")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=None,
+                            help="Папка с профилями вместо PROFILE_DIR")
+        parser.add_argument("--view", default=None,
+                            help="Только представления, в имени которых "
+                                 "есть эта строка (subscriptions)")
+        parser.add_argument("--hours", type=float, default=None,
+                            help="Только профили за последние N часов")
+        parser.add_argument("--last", type=int, default=None,
+                            help="Только N последних профилей")
+        parser.add_argument("--top", type=int, default=25,
+                            help="Число функций в итоге")
+        parser.add_argument("--sort", choices=SORT_KEYS,
+                            default="cumulative",
+                            help="Сортировка функций")
+        parser.add_argument("--strip-dirs", action="store_true",
+                            help="Имена файлов без путей")
+        parser.add_argument("--list", action="store_true",
+                            help="Только список профилей, без функций")
+
+    def handle(self, *args, **options):
+        directory = options["dir"] or settings.PROFILE_DIR
+        profiles = saved_profiles(directory)
+        if options["view"]:
+            profiles = [profile for profile in profiles
+                        if options["view"] in profile.view]
+        if options["hours"] is not None:
+            since = (datetime.now(timezone.utc)
+                     - timedelta(hours=options["hours"]))
+            profiles = [profile for profile in profiles
+                        if profile.created_at >= since]
+        if options["last"]:
+            profiles = profiles[-options["last"]:]
+        if not profiles:
+            raise CommandError(f"Нет подходящих профилей в {directory}")
+
+        durations = defaultdict(list)
+        for profile in profiles:
+            # Сумма собственного времени функций - время под профилировщиком
+            total = pstats.Stats(str(profile.path)).total_tt * 1000
+            durations[profile.view].append(total)
+            self.stdout.write(
+                f"{profile.created_at:%Y-%m-%d %H:%M:%S}  "
+                f"{total:9.1f} мс  {profile.view}  {profile.path.name}"
+            )
+
+        self.stdout.write("")
+        for view, timings in sorted(durations.items(),
+                                    key=lambda item: -sum(item[1])):
+            self.stdout.write(
+                f"{view}: профилей {len(timings)}, медиана "
+                f"{statistics.median(timings):.1f} мс, максимум "
+                f"{max(timings):.1f} мс"
+            )
+        if options["list"]:
+            return
+
+        # pstats печатает через print, и OutputWrapper удвоил бы переводы
+        # строк
+        output = io.StringIO()
+        stats = pstats.Stats(*(str(profile.path) for profile in profiles),
+                             stream=output)
+        if options["strip_dirs"]:
+            stats.strip_dirs()
+        stats.sort_stats(options["sort"]).print_stats(options["top"])
+        self.stdout.write(output.getvalue(), ending="")
@@ -1,4 +1,16 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class ApiPagination(PageNumberPagination):
@@ -8,3 +20,203 @@ class ApiPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = "limit"
     page_query_param = "page"
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset для асинхронных представлений: COUNT
+        и страница загружаются асинхронным ORM
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        self.page.object_list = [
+            instance async for instance in self.page.object_list
+        ]
+        return list(self.page)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу: страница начинается после последней записи
+    предыдущей. Не делает COUNT и OFFSET, поэтому не зависит от
+    глубины страницы.
+    """
+    page_size = ApiPagination.page_size
+    page_size_query_param = ApiPagination.page_size_query_param
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Неверный курсор"
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.cut_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.cut_page([instance async for instance in queryset])
+
+    def page_queryset(self, queryset, request):
+        """
+        Записи страницы и одна следующая, по которой видно, есть ли
+        следующая страница
+        """
+        cursor = self.start_page(request)
+        queryset = queryset.order_by(*self.ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(queryset.model, cursor))
+        return queryset[:self.current_page_size + 1]
+
+    def start_page(self, request):
+        """
+        Запоминает размер страницы и возвращает значения курсора из
+        запроса или None для первой страницы
+        """
+        self.request = request
+        self.current_page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        return self.decode_cursor(cursor) if cursor else None
+
+    def cut_page(self, page):
+        self.next_cursor = None
+        if len(page) > self.current_page_size:
+            page = page[:self.current_page_size]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True,
+                         "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param, self.next_cursor)
+
+    def after(self, model, values):
+        """
+        Условие "строго после values" для составного порядка сортировки
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering,
+                                self.cursor_values(model, values)):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def cursor_values(self, model, values):
+        """
+        Значения курсора в типах полей сортировки
+        """
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return [self.to_python(model, field.lstrip("-"), value)
+                for field, value in zip(self.ordering, values)]
+
+    def to_python(self, model, name, value):
+        """
+        Значение из курсора для сравнения с полем модели или числовой
+        аннотацией (например, релевантностью поиска). Курсор с
+        подходящей структурой, но значениями не тех типов, отклоняется
+        так же, как нераскодируемый.
+        """
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if isinstance(value, bool) or not isinstance(value,
+                                                         (int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                # Целое вне диапазона БД сломало бы запрос
+                return float(value)
+            except OverflowError:
+                raise NotFound(self.invalid_cursor_message)
+        try:
+            value = field.to_python(value)
+            # Валидаторы диапазона целочисленных полей для этой БД
+            field.run_validators(value)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def encode_cursor(self, instance):
+        values = [
+            getattr(instance, field.lstrip("-")) for field in self.ordering
+        ]
+        raw = json.dumps([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+
+class KeysetPaginationMixin:
+    """
+    Включает KeysetPagination для keyset_actions, если передан
+    параметр cursor или включена настройка API_KEYSET_PAGINATION.
+    По умолчанию остаётся постраничная пагинация.
+    """
+    keyset_actions = ("list",)
+    keyset_ordering = ("-created_at", "-id")
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and self.use_keyset_pagination():
+            self._paginator = KeysetPagination(self.get_keyset_ordering())
+        return super().paginator
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def use_keyset_pagination(self):
+        return (self.action in self.keyset_actions
+                and (settings.API_KEYSET_PAGINATION
+                     or KeysetPagination.cursor_query_param
+                     in self.request.query_params))
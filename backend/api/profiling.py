@@ -0,0 +1,183 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .timing import view_name
+
+logger = logging.getLogger(__name__)
+
+# Представление, время (UTC) и процесс: RecipeViewSet.list__
+# 20261018T064609_123456__4242.prof
+SEPARATOR = "__"
+TIME_FORMAT = "%Y%m%dT%H%M%S_%f"
+SUFFIX = ".prof"
+
+ProfileFile = namedtuple("ProfileFile", ("path", "view", "created_at",
+                                         "pid"))
+
+# Профилировщик один на процесс: на Python 3.12 второй cProfile
+# не включается, пока работает первый
+profiler_lock = threading.Lock()
+
+
+def profile_name(view, created_at, pid):
+    return (f"{view}{SEPARATOR}{created_at.strftime(TIME_FORMAT)}"
+            f"{SEPARATOR}{pid}{SUFFIX}")
+
+
+def parse_profile(path):
+    """
+    ProfileFile по имени файла или None для посторонних файлов
+    """
+    path = Path(path)
+    if path.suffix != SUFFIX:
+        return None
+    try:
+        view, created_at, pid = path.stem.rsplit(SEPARATOR, 2)
+        created_at = datetime.strptime(created_at, TIME_FORMAT)
+        pid = int(pid)
+    except ValueError:
+        return None
+    return ProfileFile(path, view, created_at.replace(tzinfo=timezone.utc),
+                       pid)
+
+
+def saved_profiles(directory=None):
+    """
+    Сохранённые профили от старых к новым
+    """
+    directory = Path(directory or settings.PROFILE_DIR)
+    if not directory.is_dir():
+        return []
+    profiles = filter(None, map(parse_profile, directory.iterdir()))
+    return sorted(profiles, key=lambda profile: profile.created_at)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов cProfile по требованию.
+
+    Запрос профилируется, если сотрудник (is_staff) передал заголовок
+    PROFILE_HEADER или параметр PROFILE_QUERY_PARAM, а также случайно
+    с вероятностью PROFILE_SAMPLE_RATE. Профиль сохраняется в
+    PROFILE_DIR под именем с представлением и временем, сотрудник
+    получает имя файла в том же заголовке ответа.
+
+    Одновременно профилируется один запрос процесса, остальные
+    выполняются как обычно. В асинхронном режиме в профиль попадает
+    и работа других запросов в цикле событий.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = settings.PROFILE_HEADER
+        self.meta_header = "HTTP_" + self.header.upper().replace("-", "_")
+        self.query_param = settings.PROFILE_QUERY_PARAM
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        requested = self.requested(request)
+        if requested and not self.is_staff(request):
+            requested = False
+        if not (requested or self.sampled()):
+            return self.get_response(request)
+        if not profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            profiler_lock.release()
+        return self.finish(request, response, profiler, requested,
+                           time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        requested = self.requested(request)
+        if requested and not await sync_to_async(self.is_staff)(request):
+            requested = False
+        if not (requested or self.sampled()):
+            return await self.get_response(request)
+        if not profiler_lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            profiler_lock.release()
+        return self.finish(request, response, profiler, requested,
+                           time.perf_counter() - started)
+
+    def requested(self, request):
+        value = (request.META.get(self.meta_header)
+                 or request.GET.get(self.query_param))
+        return bool(value) and value.lower() not in ("0", "false", "no")
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def is_staff(request):
+        """
+        Пользователь по аутентификации DRF: представление ещё не
+        вызвано, и request.user токена пока не установлен
+        """
+        drf_request = Request(request)
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            try:
+                result = authentication().authenticate(drf_request)
+            except APIException:
+                return False
+            if result is not None:
+                return result[0].is_staff
+        return False
+
+    def finish(self, request, response, profiler, requested, duration):
+        view = view_name(request) or "unresolved"
+        name = profile_name(view, datetime.now(timezone.utc), os.getpid())
+        directory = Path(settings.PROFILE_DIR)
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(directory / name)
+        except OSError:
+            # Профиль не должен ломать ответ
+            logger.exception("Не удалось сохранить профиль %s", name)
+            return response
+        logger.info("Профиль %s %s (%.1f мс, %s): %s", request.method,
+                    request.path, duration * 1000,
+                    "по запросу" if requested else "выборка", name)
+        if requested:
+            response[self.header] = name
+        return response
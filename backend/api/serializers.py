@@ -1,28 +1,56 @@
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch, prefetch_related_objects
 from django.db.transaction import atomic
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.serializers import (SerializerMethodField, ModelSerializer,
                                         IntegerField, ReadOnlyField,
-                                        PrimaryKeyRelatedField)
+                                        PrimaryKeyRelatedField, Field,
+                                        ListSerializer, FloatField)
 
+from recipes.images import variant_urls
 from recipes.models import (Recipe, Ingredient, Favourite,
                             ShoppingCart, RecipeIngredient,
                             FoodgramUser, Subscriber)
+from .timing import TimedSerializerMixin
 
 
-class RecipeMinSerializer(ModelSerializer):
+class ImageVariantsField(Field):
+    """
+    Ссылки на уменьшенные копии и WebP-версию изображения.
+    Пока копии не готовы, ссылки ведут на исходное изображение.
+    """
+
+    def __init__(self, image_field, variants_field, **kwargs):
+        self.image_field = image_field
+        self.variants_field = variants_field
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        urls = variant_urls(getattr(instance, self.image_field),
+                            getattr(instance, self.variants_field))
+        request = self.context.get("request")
+        if urls and request is not None:
+            urls = {variant: request.build_absolute_uri(url)
+                    for variant, url in urls.items()}
+        return urls
+
+
+class RecipeMinSerializer(TimedSerializerMixin, ModelSerializer):
     """
     Сериализатор с уменьшенным кол-вом полей
     """
+    image_variants = ImageVariantsField("image", "image_variants")
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
         read_only_fields = fields
 
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, ModelSerializer):
     """
     Сериализатор для ингредиентов
     """
@@ -32,15 +60,36 @@ class IngredientSerializer(ModelSerializer):
         fields = "__all__"
 
 
+class RecipeIngredientListSerializer(ListSerializer):
+    """
+    Проверяет список ингредиентов рецепта целиком: повторы и
+    существование всех ингредиентов одним запросом
+    """
+
+    def validate(self, data):
+        ids = [item["id"] for item in data]
+        if len(ids) != len(set(ids)):
+            raise ValidationError("Ингредиенты должны быть уникальными")
+
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in ingredients]
+        if missing:
+            raise ValidationError(
+                f"Ингредиенты не найдены: {', '.join(map(str, missing))}"
+            )
+        for item in data:
+            item["id"] = ingredients[item["id"]]
+        return data
+
+
 class RecipeIngredientCreateSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(), required=True
-    )
+    id = IntegerField(min_value=1)
     amount = IntegerField(min_value=1)
 
     class Meta:
         model = RecipeIngredient
         fields = ("id", "amount")
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class RecipeIngredientReadSerializer(ModelSerializer):
@@ -56,23 +105,27 @@ class RecipeIngredientReadSerializer(ModelSerializer):
         read_only_fields = fields
 
 
-class FoodgramUserSerializer(DjoserUserSerializer):
+class FoodgramUserSerializer(TimedSerializerMixin, DjoserUserSerializer):
     """
     Сериализатор для получения данных о пользователях
     """
     is_subscribed = SerializerMethodField(read_only=True)
     avatar = Base64ImageField(required=False)
+    avatar_variants = ImageVariantsField("avatar", "avatar_variants")
 
     class Meta:
         model = FoodgramUser
         fields = (
             "id", "email", "username",
             "first_name", "last_name",
-            "is_subscribed", "avatar",
+            "is_subscribed", "avatar", "avatar_variants",
         )
         read_only_fields = fields
 
     def get_is_subscribed(self, viewed_user):
+        is_subscribed = getattr(viewed_user, "is_subscribed", None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get("request")
         return (request
                 and request.user.is_authenticated
@@ -81,7 +134,7 @@ class FoodgramUserSerializer(DjoserUserSerializer):
                        subscriber=request.user).exists())
 
 
-class RecipeSerializer(ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, ModelSerializer):
     """
     Сериализатор для рецептов
     """
@@ -96,19 +149,29 @@ class RecipeSerializer(ModelSerializer):
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     image = Base64ImageField()
+    image_variants = ImageVariantsField("image", "image_variants")
 
     class Meta:
         model = Recipe
         fields = (
             "id", "author", "ingredients", "ingredients_data",
             "is_favorited", "is_in_shopping_cart",
-            "name", "image", "text", "cooking_time",
+            "name", "image", "image_variants", "text", "cooking_time",
         )
         read_only_fields = (
             "is_favorite", "is_shopping_cart",
         )
 
     def to_representation(self, instance):
+        # После создания и изменения рецепта продукты не загружены:
+        # загрузить их одним запросом, а не по запросу на продукт
+        prefetch_related_objects([instance], Prefetch(
+            "recipe_ingredients",
+            RecipeIngredient.objects.select_related("ingredient")
+        ))
+        author_is_subscribed = getattr(instance, "author_is_subscribed", None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = author_is_subscribed
         res = super().to_representation(instance)
         res["ingredients"] = res.pop("ingredients_data")
         return res
@@ -117,31 +180,35 @@ class RecipeSerializer(ModelSerializer):
         """
         Проверка, находится ли рецепт в избранном
         """
-        user = self.context["request"].user
-        return (user.is_authenticated
-                and Favourite.objects.filter(author=user,
-                                             recipe=recipe).exists())
+        return self._get_relation_flag(recipe, "is_favorited", Favourite)
 
     def get_is_in_shopping_cart(self, recipe: Recipe) -> bool:
         """
         Проверка, находится ли рецепт в списке  покупок
         """
+        return self._get_relation_flag(recipe, "is_in_shopping_cart",
+                                       ShoppingCart)
+
+    def _get_relation_flag(self, recipe, attr, model):
+        """
+        Берёт флаг из аннотации queryset'а, а если её нет - делает запрос
+        """
+        flag = getattr(recipe, attr, None)
+        if flag is not None:
+            return flag
         user = self.context["request"].user
         return (user.is_authenticated
-                and ShoppingCart.objects.filter(author=user,
-                                                recipe=recipe).exists())
+                and model.objects.filter(author=user,
+                                         recipe=recipe).exists())
 
     def validate(self, data):
         """
         Проверка вводных данных при создании/редактировании рецепта
         """
-        ingredients = self.initial_data.get("ingredients")
         if not data["image"]:
             raise ValidationError("Нет изображения")
-        if not ingredients:
+        if not data.get("ingredients"):
             raise ValidationError("Нет ингредиентов")
-        if len(ingredients) != len(set(item["id"] for item in ingredients)):
-            raise ValidationError("Ингредиенты должны быть уникальными")
 
         return data
 
@@ -160,9 +227,9 @@ class RecipeSerializer(ModelSerializer):
         """Обновляет рецепт"""
 
         ingredients = validated_data.pop("ingredients")
-        recipe.ingredients.clear()
-        self.set_ingredients(recipe, ingredients)
+        self.update_ingredients(recipe, ingredients)
 
+        # Сохранение рецепта обновляет updated_at и после смены продуктов
         return super().update(recipe, validated_data)
 
     def set_ingredients(self, recipe, ingredients_data):
@@ -178,8 +245,48 @@ class RecipeSerializer(ModelSerializer):
             for item in ingredients_data
         )  # тест
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит продукты рецепта к ingredients_data, меняя только
+        отличающиеся строки
+        """
+        existing = {row.ingredient_id: row
+                    for row in recipe.recipe_ingredients.all()}
+        amounts = {item["id"].pk: item["amount"]
+                   for item in ingredients_data}
+
+        removed = [row.pk for ingredient_id, row in existing.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            row = existing.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        self.set_ingredients(recipe, [
+            item for item in ingredients_data
+            if item["id"].pk not in existing
+        ])
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+    """
+    Рецепт из поиска по имеющимся продуктам: сколько продуктов
+    не хватает и какая доля продуктов рецепта уже есть
+    """
+    missing = IntegerField(read_only=True)
+    coverage = FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ("missing", "coverage")
+
 
-class UserAvatarSerializer(ModelSerializer):
+class UserAvatarSerializer(TimedSerializerMixin, ModelSerializer):
     """
     Сериализатор для управления аватарками
     """
@@ -195,24 +302,27 @@ class UserSubSerializer(FoodgramUserSerializer):
     Сериализатор для пользоватлея с подписками
     """
     recipes = SerializerMethodField()
-    recipes_count = IntegerField(source="recipes.count", read_only=True)
 
     class Meta:
         model = FoodgramUser
         fields = (
             "id", "username", "email", "first_name",
-            "last_name", "is_subscribed", "recipes", "recipes_count", "avatar"
+            "last_name", "is_subscribed", "recipes", "recipes_count", "avatar",
+            "avatar_variants",
         )
         read_only_fields = fields
 
     def get_recipes(self, obj):
         request = self.context.get("request")
-        qs = obj.recipes.all()
-        limit = request.query_params.get("recipes_limit") if request else None
-        if limit:
-            try:
-                qs = qs[:int(limit)]
-            except ValueError:
-                pass
+        qs = getattr(obj, "limited_recipes", None)
+        if qs is None:
+            qs = obj.recipes.all()
+            limit = (request.query_params.get("recipes_limit")
+                     if request else None)
+            if limit:
+                try:
+                    qs = qs[:int(limit)]
+                except ValueError:
+                    pass
         return RecipeMinSerializer(qs, many=True,
                                    context={"request": request}).data
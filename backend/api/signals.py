@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import FoodgramUser, Ingredient, Recipe, RecipeIngredient
+from .authentication import token_cache
+from .cache import recipe_response_cache
+
+
+def bump_recipe_cache():
+    transaction.on_commit(recipe_response_cache.bump)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_recipe_cache(sender, **kwargs):
+    """Сброс кэша рецептов после изменения рецептов и продуктов"""
+    bump_recipe_cache()
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipe_cache_on_ingredients(sender, action, **kwargs):
+    """Сброс кэша рецептов после изменения их продуктов"""
+    if action.startswith("post_"):
+        bump_recipe_cache()
+
+
+@receiver(post_save, sender=FoodgramUser)
+def invalidate_recipe_cache_on_author(sender, instance, created,
+                                      update_fields, **kwargs):
+    """Сброс кэша рецептов после изменения профиля автора"""
+    if created or (update_fields is not None
+                   and set(update_fields) <= {"last_login"}):
+        return
+    if instance.recipes.exists():
+        bump_recipe_cache()
+
+
+def invalidate_after_commit(invalidate, key):
+    """
+    Сбрасывает запись сразу и ещё раз после фиксации транзакции: до
+    фиксации параллельный запрос мог снова закэшировать старые данные
+    """
+    invalidate(key)
+    transaction.on_commit(lambda: invalidate(key))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    """Сброс кэша аутентификации после удаления токена (выход)"""
+    invalidate_after_commit(token_cache.invalidate, instance.key)
+
+
+@receiver(post_save, sender=FoodgramUser)
+def invalidate_token_cache_on_user(sender, instance, created, update_fields,
+                                   **kwargs):
+    """
+    Сброс кэша аутентификации после изменения пользователя, в том числе
+    деактивации и смены пароля
+    """
+    if created or (update_fields is not None
+                   and set(update_fields) <= {"last_login"}):
+        return
+    invalidate_after_commit(token_cache.invalidate_user, instance.pk)
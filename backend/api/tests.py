@@ -0,0 +1,743 @@
+import base64
+import json
+from io import StringIO
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import counters
+from recipes.images import VARIANTS, update_variants, variant_name
+from recipes.management.commands.benchmark_pantry import sql_matches
+from recipes.models import (Favourite, FeedItem, FoodgramUser, Ingredient,
+                            Recipe, RecipeIngredient, ShoppingCart,
+                            Subscriber)
+from recipes.pantry_index import pantry_index
+from recipes.search import search_recipes
+from .authentication import token_cache
+from .management.commands.check_query_budget import PNG
+
+
+IN_MEMORY_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+    },
+}
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Число SQL-запросов на каждый эндпоинт не превышает бюджета
+    и не растёт с объёмом данных
+    """
+
+    def test_query_budget(self):
+        output = StringIO()
+        try:
+            call_command("check_query_budget", stdout=output)
+        except CommandError as error:
+            self.fail(f"{error}\n{output.getvalue()}")
+
+
+@override_settings(REQUEST_TIMING_ENABLED=False)
+class ApiTestCase(TestCase):
+    """
+    Автор с тремя рецептами. Кэши процесса не откатываются вместе
+    с транзакцией теста, поэтому очищаются перед каждым тестом.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = FoodgramUser.objects.create_user(
+            email="author@test.ru", username="author", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+        cls.recipes = [
+            Recipe.objects.create(author=cls.author, name=f"Рецепт {i}",
+                                  text="Текст", cooking_time=5,
+                                  image="recipes/test.png")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        for alias in ("default", "responses"):
+            caches[alias].clear()
+        token_cache.clear()
+        self.client = APIClient()
+
+    def login(self, user):
+        key = Token.objects.get_or_create(user=user)[0].key
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {key}")
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class ConditionalGetTests(ApiTestCase):
+
+    def test_list_without_last_modified(self):
+        response = self.client.get("/api/recipes/")
+        self.assertIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+    def test_list_changes_after_old_recipe_deleted(self):
+        etag = self.client.get("/api/recipes/")["ETag"]
+        # Не самый новый рецепт: Max("updated_at") не меняется
+        self.recipes[0].delete()
+        for headers in ({"HTTP_IF_NONE_MATCH": etag},
+                        {"HTTP_IF_MODIFIED_SINCE": http_date()}):
+            response = self.client.get("/api/recipes/", **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 2)
+
+
+class AnonymousCacheTests(ApiTestCase):
+
+    def test_cache_hit_without_queries(self):
+        etag = self.client.get("/api/recipes/")["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/recipes/")
+            not_modified = self.client.get("/api/recipes/",
+                                           HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(not_modified.status_code, 304)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_keyset_list_without_count(self):
+        # Рецепты страницы с авторами и их продукты, без COUNT
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/recipes/?cursor=")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES)
+class TokenCacheTests(ApiTestCase):
+
+    def test_save_keeps_counters(self):
+        self.login(self.author)
+        self.client.get("/api/users/me/")
+        # Счётчик меняется после того, как пользователь попал в кэш
+        Recipe.objects.create(author=self.author, name="Новый",
+                              text="Текст", cooking_time=5,
+                              image="recipes/test.png")
+        response = self.client.put("/api/users/me/avatar/",
+                                   {"avatar": PNG}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 4)
+
+
+class ShoppingListTests(ApiTestCase):
+
+    def test_download_sums_shared_ingredients(self):
+        sugar = Ingredient.objects.create(name="сахар", measurement_unit="г")
+        milk = Ingredient.objects.create(name="молоко",
+                                         measurement_unit="мл")
+        first, second, other = self.recipes
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=first, ingredient=sugar, amount=100),
+            RecipeIngredient(recipe=first, ingredient=milk, amount=200),
+            RecipeIngredient(recipe=second, ingredient=sugar, amount=50),
+            RecipeIngredient(recipe=other, ingredient=milk, amount=999),
+        ])
+        ShoppingCart.objects.create(author=self.author, recipe=first)
+        ShoppingCart.objects.create(author=self.author, recipe=second)
+        self.login(self.author)
+
+        response = self.client.get("/api/recipes/download_shopping_cart/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Disposition"],
+                         'attachment; filename="shopping_list.txt"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[2:], [
+            "Ингредиенты:",
+            "1. Молоко: 200 мл",
+            "2. Сахар: 150 г",
+            "",
+            "Рецепты в корзине:",
+            "- Рецепт 0 (автор: Имя Фамилия)",
+            "- Рецепт 1 (автор: Имя Фамилия)",
+        ])
+        self.assertTrue(lines[0].startswith("Список ингредиентов на "))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+INVALID_CURSORS = (
+    "не-base64",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    encode_cursor({"created_at": "2020-01-01T00:00:00"}),
+    encode_cursor(["2020-01-01T00:00:00"]),
+    encode_cursor(["2020-01-01T00:00:00", 1, 2]),
+    encode_cursor(["abc", 1]),
+    encode_cursor(["2020-01-01T00:00:00", "x"]),
+    encode_cursor([None, 1]),
+    encode_cursor([["2020-01-01T00:00:00"], 1]),
+    encode_cursor(["2020-01-01T00:00:00", 10 ** 30]),
+)
+
+
+class KeysetPaginationTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes += [
+            Recipe.objects.create(author=cls.author, name=f"Рецепт {i}",
+                                  text="Текст", cooking_time=5,
+                                  image="recipes/test.png")
+            for i in range(3, 8)
+        ]
+        # Одинаковая дата у нескольких рецептов: порядок решает id
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in cls.recipes[2:6]]
+        ).update(created_at=cls.recipes[2].created_at)
+
+    def test_pages_without_duplicates_or_gaps(self):
+        response = self.client.get("/api/recipes/?cursor=&limit=3")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        seen = [recipe["id"] for recipe in response.data["results"]]
+        self.assertEqual(len(seen), 3)
+        pages = 1
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe["id"] for recipe in response.data["results"]]
+            pages += 1
+        expected = list(Recipe.objects.order_by(
+            "-created_at", "-id"
+        ).values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+
+    def test_invalid_cursor(self):
+        for cursor in INVALID_CURSORS:
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/recipes/",
+                                           {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES)
+class ImageVariantsTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.recipe.image.save("dish.png", self.png(), save=False)
+        self.recipe.save()
+
+    @staticmethod
+    def png():
+        return ContentFile(base64.b64decode(PNG.split(",", 1)[1]))
+
+    def get_variants(self):
+        response = self.client.get(f"/api/recipes/{self.recipe.pk}/")
+        self.assertEqual(response.status_code, 200)
+        return response.data["image"], response.data["image_variants"]
+
+    def test_original_until_variants_built(self):
+        image, variants = self.get_variants()
+        self.assertEqual(variants, dict.fromkeys(VARIANTS, image))
+
+        # Задача пула, выполненная синхронно; после коммита она
+        # сбрасывает кэш ответов
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(update_variants(
+                Recipe.objects.get(pk=self.recipe.pk),
+                "image", "image_variants"
+            ))
+
+        image, variants = self.get_variants()
+        name = self.recipe.image.name
+        for variant in VARIANTS:
+            self.assertTrue(variants[variant].endswith(
+                "/media/" + variant_name(name, variant)
+            ))
+            self.assertTrue(self.recipe.image.storage.exists(
+                variant_name(name, variant)
+            ))
+
+    def test_replaced_image_keeps_newer_variants(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        # Новый файл загружен, пока строились изображения старого
+        self.recipe.image.save("new.png", self.png(), save=False)
+        self.recipe.save()
+        self.assertTrue(update_variants(
+            Recipe.objects.get(pk=self.recipe.pk), "image", "image_variants"
+        ))
+        variants = Recipe.objects.get(pk=self.recipe.pk).image_variants
+
+        self.assertFalse(update_variants(stale, "image", "image_variants"))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_variants, variants)
+        self.assertEqual(variants["source"], self.recipe.image.name)
+        for variant in VARIANTS:
+            self.assertFalse(stale.image.storage.exists(
+                variant_name(stale.image.name, variant)
+            ))
+
+
+class CounterTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = FoodgramUser.objects.create_user(
+            email="reader@test.ru", username="reader", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+
+    @staticmethod
+    def fresh_counts():
+        """
+        Настоящие значения счётчиков через Count(): {поле: {pk: число}}
+        """
+        related = {
+            "favourites_count": (Recipe, "favourites"),
+            "recipes_count": (FoodgramUser, "recipes"),
+            "subscriptions_count": (FoodgramUser, "subscribers"),
+            "subscribers_count": (FoodgramUser, "publishers"),
+        }
+        return {
+            field: dict(model.objects.annotate(
+                count=Count(relation)
+            ).values_list("pk", "count"))
+            for field, (model, relation) in related.items()
+        }
+
+    def assertCountersMatch(self):
+        for counter in counters.COUNTERS:
+            target = Recipe if counter.target == "Recipe" else FoodgramUser
+            self.assertEqual(
+                dict(target.objects.values_list("pk",
+                                                counter.counter_field)),
+                self.fresh_counts()[counter.counter_field],
+                counter.counter_field,
+            )
+
+    def test_add_and_remove(self):
+        self.login(self.reader)
+        recipe = self.recipes[0]
+        self.assertEqual(self.client.post(
+            f"/api/recipes/{recipe.pk}/favorite/"
+        ).status_code, 201)
+        self.assertEqual(self.client.post(
+            f"/api/users/{self.author.pk}/subscribe/"
+        ).status_code, 201)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favourites_count, 1)
+        self.assertCountersMatch()
+
+        self.assertEqual(self.client.delete(
+            f"/api/recipes/{recipe.pk}/favorite/"
+        ).status_code, 204)
+        self.assertEqual(self.client.delete(
+            f"/api/users/{self.author.pk}/subscribe/"
+        ).status_code, 204)
+        self.assertCountersMatch()
+
+    def test_cascade_delete(self):
+        Favourite.objects.create(author=self.reader, recipe=self.recipes[0])
+        Subscriber.objects.create(subscriber=self.reader,
+                                  publisher=self.author)
+        Subscriber.objects.create(subscriber=self.author,
+                                  publisher=self.reader)
+        self.assertCountersMatch()
+
+        # Рецепт удаляется вместе с избранным, автор - вместе
+        # с рецептами и подписками в обе стороны
+        self.recipes[0].delete()
+        self.assertCountersMatch()
+        self.author.delete()
+        self.assertCountersMatch()
+        self.reader.refresh_from_db()
+        self.assertEqual((self.reader.subscriptions_count,
+                          self.reader.subscribers_count), (0, 0))
+
+    def test_rebuild_counters(self):
+        Favourite.objects.create(author=self.reader, recipe=self.recipes[0])
+        Subscriber.objects.create(subscriber=self.reader,
+                                  publisher=self.author)
+        # Расхождение, например, после загрузки данных мимо сигналов
+        Recipe.objects.update(favourites_count=7)
+        FoodgramUser.objects.update(recipes_count=0, subscriptions_count=0,
+                                    subscribers_count=3)
+
+        fresh = self.fresh_counts()
+        for counter in counters.COUNTERS:
+            target = Recipe if counter.target == "Recipe" else FoodgramUser
+            self.assertEqual(
+                dict(target.objects.annotate(
+                    actual=counters.actual_count(counter)
+                ).values_list("pk", "actual")),
+                fresh[counter.counter_field],
+                counter.counter_field,
+            )
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_counters", "--check", stdout=StringIO())
+        call_command("rebuild_counters", stdout=StringIO())
+        self.assertCountersMatch()
+        call_command("rebuild_counters", "--check", stdout=StringIO())
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES)
+class RecipeUpdateTests(ApiTestCase):
+
+    def test_patch_changes_only_differing_ingredients(self):
+        recipe = self.recipes[0]
+        kept, changed, removed, added = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("мука", "сахар", "соль", "масло")
+        )
+        rows = RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in ((kept, 100), (changed, 200),
+                                       (removed, 5))
+        )
+        ids = {row.ingredient_id: row.pk for row in rows}
+
+        self.login(self.author)
+        response = self.client.patch(f"/api/recipes/{recipe.pk}/", {
+            "name": recipe.name,
+            "text": recipe.text,
+            "cooking_time": recipe.cooking_time,
+            "image": PNG,
+            "ingredients": [
+                {"id": kept.pk, "amount": 100},
+                {"id": changed.pk, "amount": 250},
+                {"id": added.pk, "amount": 30},
+            ],
+        }, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        expected = {kept.pk: 100, changed.pk: 250, added.pk: 30}
+        self.assertEqual(
+            {item["id"]: item["amount"]
+             for item in response.data["ingredients"]},
+            expected,
+        )
+        rows = {row.ingredient_id: row
+                for row in recipe.recipe_ingredients.all()}
+        self.assertEqual(
+            {pk: row.amount for pk, row in rows.items()}, expected
+        )
+        # Совпадающие и изменённые строки обновлены на месте,
+        # а не удалены и вставлены заново
+        self.assertEqual(rows[kept.pk].pk, ids[kept.pk])
+        self.assertEqual(rows[changed.pk].pk, ids[changed.pk])
+        self.assertNotIn(rows[added.pk].pk, ids.values())
+        self.assertFalse(RecipeIngredient.objects.filter(
+            pk=ids[removed.pk]
+        ).exists())
+
+
+class SearchTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = FoodgramUser.objects.create_user(
+            email="other@test.ru", username="other", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+        recipes = {
+            "in_name": (cls.author, "Борщ украинский", "Свёкла и капуста"),
+            "in_text": (cls.author, "Суп", "Почти как борщ"),
+            "in_both": (cls.author, "Борщ", "Борщ со сметаной"),
+            "other_author": (cls.other, "Зелёный борщ", "Щавель"),
+        }
+        cls.found = {
+            key: Recipe.objects.create(author=author, name=name, text=text,
+                                       cooking_time=5,
+                                       image="recipes/test.png")
+            for key, (author, name, text) in recipes.items()
+        }
+
+    def search(self, query, **params):
+        response = self.client.get("/api/recipes/",
+                                   {"search": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe["id"] for recipe in response.data["results"]]
+
+    def test_name_and_text(self):
+        found = self.found
+        self.assertEqual(self.search("украинский"), [found["in_name"].pk])
+        self.assertEqual(self.search("капуста"), [found["in_name"].pk])
+        self.assertEqual(self.search("сметаной"), [found["in_both"].pk])
+        self.assertEqual(self.search("щавель"),
+                         [found["other_author"].pk])
+        self.assertEqual(self.search("пельмени"), [])
+
+    def test_ranking(self):
+        found = self.found
+        ids = self.search("борщ", author=self.author.pk)
+        # Слово и в названии, и в тексте выше, чем только в названии,
+        # а название важнее текста
+        self.assertEqual(ids, [found["in_both"].pk, found["in_name"].pk,
+                               found["in_text"].pk])
+
+    def test_combined_with_filters(self):
+        found = self.found
+        self.assertEqual(self.search("борщ", author=self.other.pk),
+                         [found["other_author"].pk])
+        Favourite.objects.create(author=self.other, recipe=found["in_text"])
+        Favourite.objects.create(author=self.other,
+                                 recipe=self.recipes[0])
+        self.login(self.other)
+        self.assertEqual(self.search("борщ", is_favorited=1),
+                         [found["in_text"].pk])
+
+    def test_cursor_includes_rank(self):
+        expected = self.search("борщ")
+        self.assertEqual(len(expected), 4)
+
+        response = self.client.get("/api/recipes/", {
+            "search": "борщ", "cursor": "", "limit": 1,
+        })
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+            if not url:
+                break
+            cursor = parse_qs(urlsplit(url).query)["cursor"][0]
+            rank, created_at, pk = json.loads(
+                base64.urlsafe_b64decode(cursor)
+            )
+            self.assertIsInstance(rank, float)
+            self.assertEqual(pk, seen[-1])
+            response = self.client.get(url)
+        self.assertEqual(seen, expected)
+
+    def test_index_follows_updates_and_deletes(self):
+        def matches(query):
+            return set(search_recipes(Recipe.objects.all(), query)
+                       .values_list("pk", flat=True))
+
+        recipe = self.found["in_name"]
+        recipe.name = "Щи"
+        recipe.text = "Кислая капуста"
+        recipe.save()
+        self.assertNotIn(recipe.pk, matches("украинский"))
+        self.assertNotIn(recipe.pk, matches("свёкла"))
+        self.assertEqual(matches("щи"), {recipe.pk})
+        self.assertEqual(matches("кислая"), {recipe.pk})
+
+        recipe.delete()
+        self.assertEqual(matches("щи"), set())
+        self.assertEqual(matches("капуста"), set())
+
+
+class PantryTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"Продукт {i}", measurement_unit="г")
+            for i in range(5)
+        )
+        compositions = {
+            "two": (0, 1),
+            "three": (0, 1, 2),
+            "four": (0, 2, 3, 4),
+            "unrelated": (3,),
+            "two_newer": (0, 1),
+        }
+        cls.pantry = {}
+        for key, positions in compositions.items():
+            # Производные изображения готовы: сохранение рецепта
+            # не ставит задачу в пул
+            recipe = cls.pantry[key] = Recipe.objects.create(
+                author=cls.author, name=key, text="Текст", cooking_time=5,
+                image="recipes/test.png",
+                image_variants={"source": "recipes/test.png"},
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe,
+                                 ingredient=cls.ingredients[position],
+                                 amount=1)
+                for position in positions
+            )
+
+    def setUp(self):
+        super().setUp()
+        # Индекс процесса мог остаться от другого теста
+        pantry_index.invalidate(rebuild=True)
+
+    def can_cook(self, positions, missing):
+        ids = [self.ingredients[position].pk for position in positions]
+        response = self.client.get("/api/recipes/can_cook/", {
+            "ingredients": ",".join(map(str, ids)), "missing": missing,
+        })
+        self.assertEqual(response.status_code, 200)
+        return ids, [(recipe["id"], recipe["missing"], recipe["coverage"])
+                     for recipe in response.data["results"]]
+
+    def test_missing_and_coverage(self):
+        pantry = self.pantry
+        _, results = self.can_cook((0, 1), 3)
+        self.assertEqual(results, [
+            (pantry["two_newer"].pk, 0, 1.0),
+            (pantry["two"].pk, 0, 1.0),
+            (pantry["three"].pk, 1, 0.667),
+            (pantry["four"].pk, 3, 0.25),
+        ])
+
+    def test_max_missing_cutoff(self):
+        pantry = self.pantry
+        expected = [pantry["two_newer"].pk, pantry["two"].pk,
+                    pantry["three"].pk, pantry["four"].pk]
+        for missing, count in ((0, 2), (1, 3), (2, 3), (3, 4)):
+            with self.subTest(missing=missing):
+                _, results = self.can_cook((0, 1), missing)
+                self.assertEqual([pk for pk, *_ in results],
+                                 expected[:count])
+                self.assertTrue(all(item[1] <= missing for item in results))
+
+    def test_matches_sql(self):
+        for positions in ((0,), (0, 1), (2, 3), (0, 2, 3, 4), (1, 4)):
+            for missing in range(4):
+                with self.subTest(positions=positions, missing=missing):
+                    ids, results = self.can_cook(positions, missing)
+                    self.assertEqual([pk for pk, *_ in results],
+                                     sql_matches(ids, missing))
+
+    def test_index_follows_ingredient_changes(self):
+        recipe = self.pantry["four"]
+        _, results = self.can_cook((0, 1), 0)
+        self.assertNotIn(recipe.pk, [pk for pk, *_ in results])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.recipe_ingredients.exclude(
+                ingredient=self.ingredients[0]
+            ).delete()
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredients[1], amount=1
+            )
+            recipe.save()
+
+        ids, results = self.can_cook((0, 1), 0)
+        self.assertIn((recipe.pk, 0, 1.0), results)
+        self.assertEqual([pk for pk, *_ in results], sql_matches(ids, 0))
+
+
+class FeedTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = FoodgramUser.objects.create_user(
+            email="reader@test.ru", username="reader", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.login(self.reader)
+
+    def feed_items(self):
+        return set(FeedItem.objects.filter(
+            subscriber=self.reader
+        ).values_list("recipe_id", flat=True))
+
+    def feed(self, **params):
+        response = self.client.get("/api/recipes/feed/", params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe["id"] for recipe in response.data["results"]]
+
+    def subscribe(self):
+        self.assertEqual(self.client.post(
+            f"/api/users/{self.author.pk}/subscribe/"
+        ).status_code, 201)
+
+    def test_backfill_and_publish(self):
+        self.subscribe()
+        self.assertEqual(self.feed_items(),
+                         {recipe.pk for recipe in self.recipes})
+
+        recipe = Recipe.objects.create(author=self.author, name="Новый",
+                                       text="Текст", cooking_time=5,
+                                       image="recipes/test.png")
+        self.assertIn(recipe.pk, self.feed_items())
+        self.assertEqual(self.feed(), list(Recipe.objects.order_by(
+            "-created_at", "-id"
+        ).values_list("id", flat=True)))
+
+    def test_unsubscribe_and_recipe_delete(self):
+        self.subscribe()
+        self.recipes[0].delete()
+        self.assertEqual(self.feed_items(),
+                         {recipe.pk for recipe in self.recipes[1:]})
+
+        self.assertEqual(self.client.delete(
+            f"/api/users/{self.author.pk}/subscribe/"
+        ).status_code, 204)
+        self.assertEqual(self.feed_items(), set())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author_read_directly(self):
+        other = FoodgramUser.objects.create_user(
+            email="other@test.ru", username="other", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+        Subscriber.objects.create(subscriber=other, publisher=self.author)
+        self.subscribe()
+        self.assertEqual(self.feed_items(), set())
+        expected = list(Recipe.objects.order_by(
+            "-created_at", "-id"
+        ).values_list("id", flat=True))
+
+        response = self.client.get("/api/recipes/feed/", {"limit": 2})
+        seen = [recipe["id"] for recipe in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        seen += [recipe["id"] for recipe in response.data["results"]]
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        self.subscribe()
+        for cursor in INVALID_CURSORS:
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/recipes/feed/",
+                                           {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_HEADER=True,
+                   RESPONSE_CACHE_ENABLED=False)
+class RequestTimingTests(ApiTestCase):
+
+    def test_serialize_bucket(self):
+        with self.assertLogs("api.timing", "INFO") as logs:
+            response = self.client.get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+        header = {
+            metric.split(";")[0]: dict(
+                part.split("=", 1) for part in metric.split(";")[1:]
+            )
+            for metric in response["Server-Timing"].split(", ")
+        }
+        serialize = float(header["serialize"]["dur"])
+        self.assertGreater(serialize, 0)
+        self.assertLessEqual(serialize, float(header["view"]["dur"]))
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line["serialize_ms"], serialize)
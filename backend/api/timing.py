@@ -0,0 +1,325 @@
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow_queries")
+
+# Замеры текущего запроса. Контекст копируется в потоки sync_to_async,
+# поэтому запросы асинхронного ORM тоже попадают в замеры.
+current_timing = ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """
+    Замеры одного запроса (время в секундах от perf_counter)
+    """
+    __slots__ = ("request", "started", "view_done", "finished", "render",
+                 "serialize", "serializing", "db", "queries")
+
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.view_done = None
+        self.finished = None
+        self.render = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+        self.db = 0.0
+        self.queries = 0
+
+    def view_time(self):
+        """
+        Время до ответа представления вместе с его запросами к БД.
+        Рендеринг внутри представления (асинхронные действия) вычитается.
+        """
+        if self.view_done is not None:
+            return self.view_done - self.started
+        return self.finished - self.started - self.render
+
+    def metrics(self, size=None):
+        metrics = {
+            "queries": self.queries,
+            "db_ms": round(self.db * 1000, 2),
+            "view_ms": round(self.view_time() * 1000, 2),
+            "serialize_ms": round(self.serialize * 1000, 2),
+            "render_ms": round(self.render * 1000, 2),
+            "total_ms": round((self.finished - self.started) * 1000, 2),
+        }
+        if size is not None:
+            metrics["size"] = size
+        return metrics
+
+    def server_timing(self, size=None):
+        metrics = self.metrics(size)
+        header = [
+            f'db;dur={metrics["db_ms"]};desc="{self.queries} queries"',
+            f"view;dur={metrics['view_ms']}",
+            f"serialize;dur={metrics['serialize_ms']}",
+            f"render;dur={metrics['render_ms']}",
+            f"total;dur={metrics['total_ms']}",
+        ]
+        if size is not None:
+            header.append(f'size;desc="{size} bytes"')
+        return ", ".join(header)
+
+
+def view_name(request):
+    """
+    Класс и действие DRF (RecipeViewSet.list) или путь функции
+    представления
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    view = match.func
+    view_class = getattr(view, "cls", None)
+    if view_class is None:
+        return match._func_path
+    method = request.method.lower()
+    actions = getattr(view, "actions", None) or {}
+    action = actions.get(method) or actions.get(
+        "get" if method == "head" else method, method
+    )
+    return f"{view_class.__name__}.{action}"
+
+
+def query_origin(frame):
+    """
+    Первая строка кода проекта в стеке вызова SQL-запроса
+    """
+    project = str(settings.BASE_DIR)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(project) and filename != __file__
+                and "site-packages" not in filename):
+            path = Path(filename).relative_to(project)
+            return f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Обёртка выполнения SQL для всех соединений: время и число запросов
+    текущего запроса, медленные запросы - в отдельный лог
+    """
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        timing = current_timing.get()
+        if timing is not None:
+            timing.db += duration
+            timing.queries += 1
+        if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+            log_slow_query(sql, duration, context, timing)
+
+
+def log_slow_query(sql, duration, context, timing):
+    # Параметры не пишутся: в них бывают токены и личные данные
+    slow_query_logger.warning(json.dumps({
+        "view": timing and view_name(timing.request),
+        "duration_ms": round(duration * 1000, 2),
+        "database": context["connection"].alias,
+        "sql": sql,
+        "origin": query_origin(sys._getframe(2)),
+    }, ensure_ascii=False))
+
+
+def install_query_timer(connection, **kwargs):
+    # Сигнал приходит при каждом переподключении того же объекта
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def render_timer():
+    """
+    Рендеринг ответа внутри представления
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = current_timing.get()
+        if timing is not None:
+            timing.render += time.perf_counter() - started
+
+
+@contextmanager
+def serialize_timer():
+    """
+    Сериализация ответа. Вложенные сериализаторы уже учтены во внешнем.
+    """
+    timing = current_timing.get()
+    if timing is None or timing.serializing:
+        yield
+        return
+    timing.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.serializing = False
+        timing.serialize += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """
+    Время to_representation сериализатора попадает в замеры запроса.
+    Для many=True замеряется каждый объект списка.
+    """
+
+    def to_representation(self, instance):
+        with serialize_timer():
+            return super().to_representation(instance)
+
+
+class RequestTimingMiddleware:
+    """
+    Замеры каждого запроса: число и время SQL-запросов, время
+    представления, сериализации внутри него и рендеринга, размер ответа.
+
+    Замеры отдаются в заголовке Server-Timing и пишутся JSON-строкой
+    в логгер api.timing с классом и действием представления.
+    SQL-запросы дольше SLOW_QUERY_THRESHOLD_MS пишутся в
+    api.timing.slow_queries с текстом запроса и строкой кода, из
+    которой он выполнен. Потоковые ответы попадают в лог после
+    отправки последней части.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = settings.REQUEST_TIMING_HEADER
+        connection_created.connect(install_query_timer)
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_template_response = (
+                self.aprocess_template_response
+            )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = request.timing = RequestTiming(request)
+        token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.finish(timing, response)
+
+    async def __acall__(self, request):
+        timing = request.timing = RequestTiming(request)
+        token = current_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.finish(timing, response)
+
+    def process_template_response(self, request, response):
+        return self.time_render(request, response)
+
+    async def aprocess_template_response(self, request, response):
+        return self.time_render(request, response)
+
+    @staticmethod
+    def time_render(request, response):
+        """
+        Ответ DRF рендерится после представления: отмечаем границу
+        """
+        timing = getattr(request, "timing", None)
+        if timing is not None:
+            timing.view_done = time.perf_counter()
+
+            def rendered(response):
+                timing.render = time.perf_counter() - timing.view_done
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, timing, response):
+        timing.finished = time.perf_counter()
+        size = None
+        if not response.streaming:
+            size = len(response.content)
+            self.log(timing, response, size)
+        elif getattr(response, "file_to_stream", None) is not None:
+            # Файл может отдать сам сервер, минуя streaming_content
+            self.log(timing, response,
+                     int(response.get("Content-Length") or 0) or None)
+        else:
+            # Представление закончилось с ответом, запрос - с последней
+            # частью ответа
+            timing.view_done = timing.view_done or timing.finished
+            count = self.acount if response.is_async else self.count
+            response.streaming_content = count(timing, response,
+                                               response.streaming_content)
+        if self.header:
+            response["Server-Timing"] = timing.server_timing(size)
+        return response
+
+    def count(self, timing, response, chunks):
+        """
+        Части потокового ответа. Запросы к БД при их создании относятся
+        к этому запросу, а в лог он попадает после последней части.
+        """
+        previous = current_timing.get()
+        current_timing.set(timing)
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            current_timing.set(previous)
+            timing.finished = time.perf_counter()
+            self.log(timing, response, size)
+
+    async def acount(self, timing, response, chunks):
+        previous = current_timing.get()
+        current_timing.set(timing)
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            current_timing.set(previous)
+            timing.finished = time.perf_counter()
+            self.log(timing, response, size)
+
+    @staticmethod
+    def log(timing, response, size):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        request = timing.request
+        match = getattr(request, "resolver_match", None)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "view": view_name(request),
+            "route": match.view_name if match is not None else None,
+            **timing.metrics(size),
+        }, ensure_ascii=False))
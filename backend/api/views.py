@@ -1,59 +1,144 @@
-from django.http.response import FileResponse
+from django.conf import settings
+from django.db.models import (BooleanField, Count, Exists, Max, OuterRef,
+                              Prefetch, Subquery, Sum, Value,
+                              prefetch_related_objects)
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import content_disposition_header
 from django.utils.timezone import now
-from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.exceptions import MethodNotAllowed, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes import feed
+from recipes.ingredient_index import ingredient_index
+from recipes.pantry_index import pantry_index
+from recipes.search import rank_recipes, search_recipes
 from recipes.models import (Ingredient, Recipe,
                             Favourite, ShoppingCart,
                             RecipeIngredient, FoodgramUser,
                             Subscriber)
-from .filters import IngredientFilter
-from .paginators import ApiPagination
+from .async_views import AsyncReadMixin
+from .cache import AnonymousResponseCacheMixin, recipe_response_cache
+from .conditional import ConditionalGetMixin
+from .paginators import (ApiPagination, KeysetPagination,
+                         KeysetPaginationMixin)
 from .permissions import AuthorOrReadPermission
 from .serializers import (IngredientSerializer, RecipeSerializer,
-                          RecipeMinSerializer, UserAvatarSerializer,
-                          UserSubSerializer)
+                          RecipeMatchSerializer, RecipeMinSerializer,
+                          UserAvatarSerializer, UserSubSerializer)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
     """
     Просмотр ингредиентов
     """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = IngredientFilter
+    async_actions = ("list",)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по началу названия через индекс в памяти
+        """
+        ingredients = ingredient_index.search(
+            request.query_params.get("name", "")
+        )
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+    async def alist(self, request, *args, **kwargs):
+        ingredients = await ingredient_index.asearch(
+            request.query_params.get("name", "")
+        )
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(KeysetPaginationMixin, AnonymousResponseCacheMixin,
+                    ConditionalGetMixin, AsyncReadMixin,
+                    viewsets.ModelViewSet):
     """
     Класс для управления рецептами
     """
     pagination_class = ApiPagination
     serializer_class = RecipeSerializer
+    response_cache = recipe_response_cache
+    search_query_param = "search"
+    search_ordering = ("-search_rank", "-created_at", "-id")
 
     def get_permissions(self):
         if self.action in ("create", "shopping_cart", "favorite",
-                           "download_shopping_cart"):
+                           "download_shopping_cart", "feed"):
             return [IsAuthenticated()]
-        elif self.action in ("list", "retrieve", "get_link"):
+        elif self.action in ("list", "retrieve", "get_link", "can_cook"):
             return [AllowAny()]
         elif self.action in ("partial_update", "destroy"):
             return [IsAuthenticated(), AuthorOrReadPermission()]
         raise MethodNotAllowed(f"Method {self.action} is not allowed")
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
+        queryset = self.filter_recipes(self.get_recipes())
+        search = self.get_search_query()
+        if search:
+            queryset = rank_recipes(queryset, search).order_by(
+                *self.search_ordering
+            )
+        return queryset
 
-        is_favorited = self.request.query_params.get("is_favorited")
+    def get_recipes(self):
+        """
+        Рецепты с автором, продуктами и флагами пользователя
+        """
+        queryset = Recipe.objects.select_related("author").prefetch_related(
+            Prefetch("recipe_ingredients",
+                     queryset=RecipeIngredient.objects.select_related(
+                         "ingredient"))
+        )
+        return self.annotate_user_flags(queryset)
+
+    def get_search_query(self):
+        return self.request.query_params.get(
+            self.search_query_param, ""
+        ).strip()
+
+    def get_keyset_ordering(self):
+        # Курсор поиска включает релевантность
+        if self.get_search_query():
+            return self.search_ordering
+        return super().get_keyset_ordering()
+
+    def annotate_user_flags(self, queryset):
+        """
+        Добавляет флаги избранного, корзины и подписки на автора
+        """
+        user = self.request.user
+        if user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Exists(Favourite.objects.filter(
+                    author=user, recipe=OuterRef("pk"))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    author=user, recipe=OuterRef("pk"))),
+                author_is_subscribed=Exists(Subscriber.objects.filter(
+                    subscriber=user, publisher=OuterRef("author"))),
+            )
+        false = Value(False, output_field=BooleanField())
+        return queryset.annotate(
+            is_favorited=false,
+            is_in_shopping_cart=false,
+            author_is_subscribed=false,
+        )
+
+    def filter_recipes(self, queryset):
+        """
+        Фильтры из параметров запроса
+        """
         user = self.request.user
+        is_favorited = self.request.query_params.get("is_favorited")
         if is_favorited == "1" and not user.is_anonymous:
             queryset = queryset.filter(favourites__author=user)
 
@@ -66,8 +151,97 @@ class RecipeViewSet(viewsets.ModelViewSet):
         if author_id is not None:
             queryset = queryset.filter(author_id=author_id)
 
+        search = self.get_search_query()
+        if search:
+            queryset = search_recipes(queryset, search)
+
         return queryset
 
+    def get_validators(self, request, *args, **kwargs):
+        """
+        Состояние для ETag и дата изменения одним агрегирующим запросом.
+        Для авторизованных пользователей учитываются их избранное,
+        корзина и подписки, а Last-Modified не отдаётся.
+
+        Список отдаётся без Last-Modified: удаление не самого нового
+        рецепта не меняет Max("updated_at"), а число рецептов в ETag
+        меняет. При пагинации по курсору валидаторов нет: она нужна,
+        чтобы не считать COUNT по всей таблице.
+        """
+        user = request.user
+        if self.action == "retrieve":
+            queryset = self.get_recipe_state(kwargs["pk"])
+            state = queryset.first() if queryset is not None else None
+            if state is None:
+                return None, None
+            return self.make_validators(user, state, state[0])
+        if self.use_keyset_pagination():
+            return None, None
+
+        state = self.filter_recipes(Recipe.objects.all()).aggregate(
+            last_modified=Max("updated_at"), count=Count("id")
+        )
+        if user.is_authenticated:
+            state["user"] = self.get_user_state(user).first()
+        return self.make_validators(user, state, None)
+
+    async def aget_validators(self, request, *args, **kwargs):
+        user = request.user
+        if self.action == "retrieve":
+            queryset = self.get_recipe_state(kwargs["pk"])
+            state = await queryset.afirst() if queryset is not None else None
+            if state is None:
+                return None, None
+            return self.make_validators(user, state, state[0])
+        if self.use_keyset_pagination():
+            return None, None
+
+        state = await self.filter_recipes(Recipe.objects.all()).aaggregate(
+            last_modified=Max("updated_at"), count=Count("id")
+        )
+        if user.is_authenticated:
+            state["user"] = await self.get_user_state(user).afirst()
+        return self.make_validators(user, state, None)
+
+    @staticmethod
+    def make_validators(user, state, last_modified):
+        if user.is_authenticated:
+            return (user.pk, state), None
+        return (None, state), last_modified
+
+    def get_recipe_state(self, pk):
+        """
+        Запрос даты изменения и флагов рецепта или None, если pk
+        некорректен
+        """
+        try:
+            return self.annotate_user_flags(Recipe.objects.all()).filter(
+                pk=pk
+            ).values_list("updated_at", "is_favorited",
+                          "is_in_shopping_cart", "author_is_subscribed")
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def get_user_state(user):
+        """
+        Запрос числа и последнего id избранного, корзины и подписок
+        пользователя
+        """
+        subqueries = {}
+        for name, model, field in (("favourites", Favourite, "author"),
+                                   ("carts", ShoppingCart, "author"),
+                                   ("subscriptions", Subscriber,
+                                    "subscriber")):
+            rows = (model.objects.filter(**{field: OuterRef("pk")})
+                    .order_by().values(field))
+            subqueries[f"{name}_total"] = Subquery(
+                rows.annotate(value=Count("id")).values("value"))
+            subqueries[f"{name}_last"] = Subquery(
+                rows.annotate(value=Max("id")).values("value"))
+        return (FoodgramUser.objects.filter(pk=user.pk)
+                .annotate(**subqueries).values_list(*subqueries))
+
     def _handle_post_delete_action(self, request, model, recipe):
         if request.method == "DELETE":
             get_object_or_404(model, author=request.user,
@@ -106,50 +280,136 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=["get"], url_path="download_shopping_cart")
     def download_shopping_cart(self, request):
         user = request.user
-        ingredients_dict = {}
-
-        recipes_cart = user.shoppingcarts.all()
-
-        for recipe_cart in recipes_cart:
-            recipe = recipe_cart.recipe
-            for ri in RecipeIngredient.objects.filter(recipe=recipe):
-                name = ri.ingredient.name.capitalize()
-                amount = ri.amount
-                unit = ri.ingredient.measurement_unit
-                if name in ingredients_dict:
-                    ingredients_dict[name]["amount"] += amount
-                else:
-                    ingredients_dict[name] = {"amount": amount, "unit": unit}
-
-        sorted_ingredients = sorted(ingredients_dict.items())
-
-        lines = [
-            f"Список ингредиентов на {now().strftime("%Y-%m-%d")}:",
-            "",
-            "Ингредиенты:"
-        ]
-
-        for idx, (name, det) in enumerate(sorted_ingredients, start=1):
-            lines.append(f"{idx}. {name}: {det["amount"]} "
-                         f"{det["unit"]}")
-
-        lines.append("")
-        lines.append("Рецепты в корзине:")
-        for recipe_cart in recipes_cart:
-            recipe = recipe_cart.recipe
-            lines.append(f"- {recipe.name} (автор:"
-                         f" {recipe.author.get_full_name()})")
-
-        file_content = "\n".join(lines)
-
-        response = FileResponse(
-            file_content,
-            as_attachment=True,
-            filename="shopping_list.txt",
-            content_type="text/plain"
+
+        ingredients = (
+            RecipeIngredient.objects
+            .filter(recipe__shoppingcarts__author=user)
+            .values("ingredient__name", "ingredient__measurement_unit")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        recipes = (
+            Recipe.objects
+            .filter(shoppingcarts__author=user)
+            .select_related("author")
+            .order_by("shoppingcarts__id")
+        )
+
+        response = StreamingHttpResponse(
+            self._shopping_list_lines(ingredients, recipes),
+            content_type="text/plain; charset=utf-8"
+        )
+        response["Content-Disposition"] = content_disposition_header(
+            as_attachment=True, filename="shopping_list.txt"
         )
         return response
 
+    @staticmethod
+    def _shopping_list_lines(ingredients, recipes):
+        """
+        Построчно формирует файл со списком покупок
+        """
+        yield (f"Список ингредиентов на {now().strftime('%Y-%m-%d')}:\n"
+               f"\nИнгредиенты:")
+
+        sorted_ingredients = sorted(
+            (item["ingredient__name"].capitalize(),
+             item["ingredient__measurement_unit"],
+             item["total"])
+            for item in ingredients
+        )
+        for idx, (name, unit, amount) in enumerate(sorted_ingredients,
+                                                   start=1):
+            yield f"\n{idx}. {name}: {amount} {unit}"
+
+        yield "\n\nРецепты в корзине:"
+        for recipe in recipes.iterator():
+            yield (f"\n- {recipe.name} (автор:"
+                   f" {recipe.author.get_full_name()})")
+
+    @action(detail=False, methods=["get"], url_path="can_cook")
+    def can_cook(self, request):
+        """
+        Рецепты, которые можно приготовить из продуктов ingredients,
+        докупив не больше missing продуктов
+        """
+        ingredient_ids, max_missing = self._parse_pantry(request)
+        matches = pantry_index.match(ingredient_ids, max_missing)
+        positions = self.paginate_queryset(range(len(matches.recipe_ids)))
+
+        recipes = self.get_recipes().in_bulk(
+            matches.recipe_ids[positions].tolist()
+        )
+        page = []
+        for position in positions:
+            recipe = recipes.get(int(matches.recipe_ids[position]))
+            if recipe is None:
+                continue
+            recipe.missing = int(matches.missing[position])
+            recipe.coverage = round(float(matches.coverage[position]), 3)
+            page.append(recipe)
+        # Рецепты, удалённые другим процессом, индекс ещё не знает
+        deleted = set(matches.recipe_ids[positions].tolist()) - set(recipes)
+        if deleted:
+            pantry_index.discard(deleted)
+
+        serializer = RecipeMatchSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["get"], url_path="feed")
+    def feed(self, request):
+        """
+        Лента: рецепты авторов, на которых подписан пользователь,
+        от новых к старым. Всегда с пагинацией по курсору.
+        """
+        paginator = KeysetPagination(self.keyset_ordering)
+        cursor = paginator.start_page(request)
+        if cursor is not None:
+            cursor = paginator.cursor_values(Recipe, cursor)
+        keys = feed.latest(request.user.pk,
+                           paginator.current_page_size + 1, cursor)
+        recipes = self.get_recipes().in_bulk(
+            [recipe_id for _, recipe_id in keys]
+        )
+        page = paginator.cut_page([recipes[recipe_id]
+                                   for _, recipe_id in keys
+                                   if recipe_id in recipes])
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def _parse_pantry(request):
+        """
+        Продукты из параметров ingredients (через запятую или
+        повторением параметра) и допустимое число недостающих
+        """
+        values = [value for param in request.query_params.getlist(
+            "ingredients") for value in param.split(",") if value.strip()]
+        try:
+            ingredient_ids = sorted({int(value) for value in values})
+        except ValueError:
+            raise ValidationError(
+                {"ingredients": ["Нужны id ингредиентов через запятую"]}
+            )
+        if not ingredient_ids:
+            raise ValidationError({"ingredients": ["Укажите продукты"]})
+        if len(ingredient_ids) > settings.PANTRY_MAX_INGREDIENTS:
+            raise ValidationError({"ingredients": [
+                f"Не больше {settings.PANTRY_MAX_INGREDIENTS} продуктов"
+            ]})
+
+        try:
+            max_missing = int(request.query_params.get("missing", 0))
+        except ValueError:
+            max_missing = -1
+        if not 0 <= max_missing <= settings.PANTRY_MAX_MISSING:
+            raise ValidationError({"missing": [
+                f"Целое число от 0 до {settings.PANTRY_MAX_MISSING}"
+            ]})
+        return ingredient_ids, max_missing
+
     @action(["get"], detail=True, url_path="get-link")
     def get_link(self, request, pk):
         """Создание короткой ссылки"""
@@ -159,12 +419,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_200_OK)
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(KeysetPaginationMixin, DjoserUserViewSet):
     """
     Класс для управления пользователем
     """
 
     pagination_class = ApiPagination
+    keyset_actions = ("subscriptions",)
+    keyset_ordering = ("email", "id")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(Subscriber.objects.filter(
+                    subscriber=user, publisher=OuterRef("pk")))
+            )
+        return queryset
 
     @action(detail=False, methods=["put"],
             permission_classes=[IsAuthenticated], url_path="me/avatar")
@@ -200,6 +472,7 @@ class UserViewSet(DjoserUserViewSet):
             return Response({"detail": f"Вы уже подписаны на"
                                        f" {publisher.username}"},
                             status=status.HTTP_400_BAD_REQUEST)
+        self.prefetch_recipes([publisher])
         data = UserSubSerializer(publisher,
                                  context={"request": request}).data
         return Response(data, status=status.HTTP_201_CREATED)
@@ -210,8 +483,34 @@ class UserViewSet(DjoserUserViewSet):
     def subscriptions(self, request):
         publisher_ids = (Subscriber.objects.filter(subscriber=request.user).
                          values_list("publisher_id", flat=True))
-        qs = FoodgramUser.objects.filter(id__in=publisher_ids)
+        qs = FoodgramUser.objects.filter(id__in=publisher_ids).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         page = self.paginate_queryset(qs)
-        serializer = UserSubSerializer(page or qs, many=True,
+        authors = page if page is not None else list(qs)
+        self.prefetch_recipes(authors)
+        serializer = UserSubSerializer(authors, many=True,
                                        context={"request": request})
         return self.get_paginated_response(serializer.data)
+
+    def prefetch_recipes(self, authors):
+        """
+        Загружает первые recipes_limit рецептов всех авторов одним
+        запросом. Срез в Prefetch Django выполняет через
+        ROW_NUMBER() OVER (PARTITION BY author_id).
+        """
+        recipes = Recipe.objects.all()
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            recipes = recipes[:limit]
+        prefetch_related_objects(
+            authors,
+            Prefetch("recipes", queryset=recipes, to_attr="limited_recipes")
+        )
+
+    def get_recipes_limit(self):
+        try:
+            limit = int(self.request.query_params["recipes_limit"])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit >= 0 else None
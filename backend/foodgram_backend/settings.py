@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.timing.RequestTimingMiddleware",
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -133,7 +135,7 @@ AUTH_USER_MODEL = 'recipes.FoodgramUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -157,6 +159,122 @@ DJOSER = {
     },
 }
 
+# default хранит версии индексов в памяти процессов (ингредиенты,
+# продукты): он должен быть общим для всех воркеров и команд
+# manage.py, например FileBasedCache на одном сервере или Redis.
+# LocMemCache подходит только для разработки в одном процессе.
+# responses - кэш ответов для анонимных запросов к рецептам
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "DEFAULT_CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": config("DEFAULT_CACHE_LOCATION", default=""),
+    },
+    "responses": {
+        "BACKEND": config(
+            "RESPONSE_CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": config("RESPONSE_CACHE_LOCATION", default="responses"),
+    },
+}
+RESPONSE_CACHE_ALIAS = "responses"
+RESPONSE_CACHE_ENABLED = config("RESPONSE_CACHE_ENABLED", default=True,
+                                cast=bool)
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", default=300,
+                                cast=int)
+
+# Пагинация по курсору для списка рецептов и подписок вместо
+# постраничной (по умолчанию включается параметром ?cursor)
+API_KEYSET_PAGINATION = config("API_KEYSET_PAGINATION", default=False,
+                               cast=bool)
+
+# Время жизни индекса ингредиентов в памяти процесса (секунды)
+INGREDIENT_INDEX_TTL = config("INGREDIENT_INDEX_TTL", default=300, cast=int)
+
+# Поиск рецептов по имеющимся продуктам: полная перестройка индекса
+# (секунды), число изменённых рецептов, после которого они сливаются
+# с основным индексом, и ограничения запроса
+PANTRY_INDEX_TTL = config("PANTRY_INDEX_TTL", default=3600, cast=int)
+PANTRY_INDEX_OVERLAY = config("PANTRY_INDEX_OVERLAY", default=5000, cast=int)
+PANTRY_MAX_INGREDIENTS = config("PANTRY_MAX_INGREDIENTS", default=100,
+                                cast=int)
+PANTRY_MAX_MISSING = config("PANTRY_MAX_MISSING", default=5, cast=int)
+
+# Лента подписок: рецепты авторов, у которых больше FEED_FANOUT_LIMIT
+# подписчиков, не раскладываются по лентам, а читаются при запросе;
+# при подписке в ленту попадают последние FEED_BACKFILL рецептов автора
+FEED_FANOUT_LIMIT = config("FEED_FANOUT_LIMIT", default=5000, cast=int)
+FEED_BACKFILL = config("FEED_BACKFILL", default=100, cast=int)
+
+# Уменьшенные копии и WebP-версии изображений рецептов и аватарок
+IMAGE_THUMBNAIL_SIZE = config("IMAGE_THUMBNAIL_SIZE", default=320, cast=int)
+IMAGE_VARIANT_QUALITY = config("IMAGE_VARIANT_QUALITY", default=80,
+                               cast=int)
+IMAGE_VARIANT_WORKERS = config("IMAGE_VARIANT_WORKERS", default=2, cast=int)
+
+# Асинхронные представления чтения (рецепты, поиск ингредиентов,
+# короткие ссылки) для запуска под ASGI-сервером
+ASYNC_READ_VIEWS = config("ASYNC_READ_VIEWS", default=False, cast=bool)
+
+# Кэш token -> пользователь: размер LRU в каждом процессе, время жизни
+# записей (секунды) и необязательный общий кэш из CACHES
+TOKEN_CACHE_SIZE = config("TOKEN_CACHE_SIZE", default=10000, cast=int)
+TOKEN_CACHE_TTL = config("TOKEN_CACHE_TTL", default=60, cast=int)
+TOKEN_CACHE_ALIAS = config("TOKEN_CACHE_ALIAS", default="") or None
+
+# Замеры каждого запроса: JSON-строки в логгер api.timing и заголовок
+# Server-Timing; SQL-запросы дольше SLOW_QUERY_THRESHOLD_MS
+# миллисекунд пишутся в api.timing.slow_queries
+REQUEST_TIMING_ENABLED = config("REQUEST_TIMING_ENABLED", default=True,
+                                cast=bool)
+REQUEST_TIMING_HEADER = config("REQUEST_TIMING_HEADER", default=True,
+                               cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config("SLOW_QUERY_THRESHOLD_MS", default=100,
+                                 cast=float)
+
+# Профилирование запросов cProfile: по заголовку PROFILE_HEADER или
+# параметру PROFILE_QUERY_PARAM от сотрудников (is_staff) и случайная
+# доля PROFILE_SAMPLE_RATE всех запросов. Профили сохраняются
+# в PROFILE_DIR, просмотр: python manage.py show_profiles
+PROFILING_ENABLED = config("PROFILING_ENABLED", default=True, cast=bool)
+PROFILE_HEADER = config("PROFILE_HEADER", default="X-Profile")
+PROFILE_QUERY_PARAM = config("PROFILE_QUERY_PARAM", default="profile")
+PROFILE_SAMPLE_RATE = config("PROFILE_SAMPLE_RATE", default=0, cast=float)
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "timing": {
+            "class": "logging.StreamHandler",
+            "formatter": "json",
+        },
+    },
+    "loggers": {
+        "api.timing": {
+            "handlers": ["timing"],
+            "level": config("REQUEST_TIMING_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+        "api.profiling": {
+            "handlers": ["timing"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# Время жизни границ фильтра по времени готовки в админке (секунды)
+COOKING_TIME_TERTILES_TTL = config("COOKING_TIME_TERTILES_TTL", default=300,
+                                   cast=int)
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
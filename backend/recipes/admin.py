@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.contrib.admin.filters import SimpleListFilter
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.safestring import mark_safe
 
+from .cooking_time import get_tertiles
 from .models import (Recipe,
                      Favourite, ShoppingCart,
                      Ingredient, Subscriber, FoodgramUser, RecipeIngredient)
@@ -10,73 +13,62 @@ from .models import (Recipe,
 
 class CookingTimeFilter(SimpleListFilter):
     """
-    Фильтр делящий рцепты на быстрые, средние и долгие
+    Фильтр делящий рцепты на быстрые, средние и долгие.
+    Границы и число рецептов считаются в БД и кэшируются.
     """
     title = "время готовки"
     parameter_name = "cooking_time_bin"
 
     def lookups(self, request, model_admin):
-        recipes = Recipe.objects.all()
-        times = list(recipes.values_list("cooking_time", flat=True))
-
-        if len(set(times)) < 3:
+        tertiles = get_tertiles()
+        if tertiles.distinct < 3:
             return []
 
-        times.sort()
-        self.n = times[len(times) // 3]
-        self.m = times[2 * len(times) // 3]
-
-        def count_in_range(lower, upper=None):
-            q = recipes
-            if upper is None:
-                q = q.filter(cooking_time__gte=lower)
-            else:
-                q = q.filter(cooking_time__gte=lower, cooking_time__lt=upper)
-            return q.count()
-
+        n, m = tertiles.n, tertiles.m
         return [
-            ("fast", f"быстро (< {self.n} мин) ({count_in_range(0, self.n)})"),
-            ("medium", f"средне (от {self.n} до {self.m} мин)"
-                       f" ({count_in_range(self.n, self.m)})"),
-            ("slow", f"долго (≥ {self.m} мин) ({count_in_range(self.m)})"),
+            ("fast", f"быстро (< {n} мин) ({tertiles.fast})"),
+            ("medium", f"средне (от {n} до {m} мин) ({tertiles.medium})"),
+            ("slow", f"долго (≥ {m} мин) ({tertiles.slow})"),
         ]
 
     def queryset(self, request, queryset):
         value = self.value()
-        n = self.n
-        m = self.m
+        if value not in ("fast", "medium", "slow"):
+            return queryset
+        tertiles = get_tertiles()
+        n, m = tertiles.n, tertiles.m
+        if n is None:
+            return queryset
 
         if value == "fast":
             return queryset.filter(cooking_time__lt=n)
         elif value == "medium":
             return queryset.filter(cooking_time__gte=n, cooking_time__lt=m)
-        elif value == "slow":
-            return queryset.filter(cooking_time__gte=m)
-        return queryset
+        return queryset.filter(cooking_time__gte=m)
 
 
 class HasRelationFilter(SimpleListFilter):
-    """Базовый фильтр: наличие связанного объекта"""
+    """
+    Базовый фильтр: наличие связанного объекта по счётчику или
+    аннотации вместо JOIN
+    """
 
     LOOKUP_CHOICES = [
         ("yes", "Есть"),
         ("no", "Нет"),
     ]
 
-    related_field = None  # задаётся в наследниках
+    counter_field = None  # задаётся в наследниках
 
     def lookups(self, request, model_admin):
         return self.LOOKUP_CHOICES
 
     def queryset(self, request, queryset):
         value = self.value()
-        if value == "yes":
-            return queryset.filter(
-                **{f"{self.related_field}__isnull": False}).distinct()
-        elif value == "no":
-            return queryset.filter(
-                **{f"{self.related_field}__isnull": True}).distinct()
-        return queryset
+        if value not in ("yes", "no"):
+            return queryset
+        lookup = "gt" if value == "yes" else "exact"
+        return queryset.filter(**{f"{self.counter_field}__{lookup}": 0})
 
 
 class HasRecipesFilter(HasRelationFilter):
@@ -84,7 +76,7 @@ class HasRecipesFilter(HasRelationFilter):
 
     title = "Есть рецепты"
     parameter_name = "has_recipes"
-    related_field = "recipes"
+    counter_field = "recipes_count"
 
 
 class HasSubscriptionsFilter(HasRelationFilter):
@@ -92,7 +84,7 @@ class HasSubscriptionsFilter(HasRelationFilter):
 
     title = "Есть подписки"
     parameter_name = "has_subscriptions"
-    related_field = "publishers"
+    counter_field = "subscriptions_count"
 
 
 class HasSubscribersFilter(HasRelationFilter):
@@ -100,7 +92,7 @@ class HasSubscribersFilter(HasRelationFilter):
 
     title = "Есть подписчики"
     parameter_name = "has_subscribers"
-    related_field = "subscribers"
+    counter_field = "subscribers_count"
 
 
 class IngrInRecipesFilter(HasRelationFilter):
@@ -110,7 +102,7 @@ class IngrInRecipesFilter(HasRelationFilter):
 
     title = "Есть в рецептах"
     parameter_name = "in_recipes"
-    related_field = "recipes"
+    counter_field = "recipes_total"
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -121,15 +113,19 @@ class RecipeIngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "cooking_time", "author",
-                    "favorites_count", "formatted_ingredients", "image")
+                    "favourites_count", "formatted_ingredients", "image")
     search_fields = ("name", "author__username")
     list_filter = ("author",
                    CookingTimeFilter)
     inlines = [RecipeIngredientInline]
 
-    @admin.display(description="В избранном")
-    def favorites_count(self, recipe):
-        return recipe.favourites.count()
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            "author"
+        ).prefetch_related(Prefetch(
+            "recipe_ingredients",
+            RecipeIngredient.objects.select_related("ingredient")
+        ))
 
     @admin.display(description="Продукты")
     @mark_safe
@@ -137,8 +133,7 @@ class RecipeAdmin(admin.ModelAdmin):
         return "<br>".join(
             f"{ri.ingredient.name} - {ri.amount}"
             f" {ri.ingredient.measurement_unit}"
-            for ri in recipe.recipe_ingredients.select_related(
-                "ingredient").all()
+            for ri in recipe.recipe_ingredients.all()
         )
 
     @admin.display(description="Картинка")
@@ -160,13 +155,27 @@ class ShoppingCartAdmin(admin.ModelAdmin):
 
 
 class RecipeCountMixin:
-    @admin.display(description="Число рецептов")
+    """
+    Число рецептов с продуктом: подзапрос в запросе списка
+    вместо COUNT на каждую строку
+    """
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_total=Coalesce(Subquery(
+                RecipeIngredient.objects.filter(ingredient=OuterRef("pk"))
+                .order_by().values("ingredient")
+                .annotate(count=Count("pk")).values("count")
+            ), 0)
+        )
+
+    @admin.display(description="Число рецептов", ordering="recipes_total")
     def recipes_count(self, ingr):
-        return ingr.recipes.count()
+        return ingr.recipes_total
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin, RecipeCountMixin):
+class IngredientAdmin(RecipeCountMixin, admin.ModelAdmin):
     model = Ingredient
     list_display = ("name", "measurement_unit", "recipes_count")
     ordering = ("name",)
@@ -176,7 +185,7 @@ class IngredientAdmin(admin.ModelAdmin, RecipeCountMixin):
 
 
 @admin.register(FoodgramUser)
-class FoodgramUserAdmin(UserAdmin, RecipeCountMixin):
+class FoodgramUserAdmin(UserAdmin):
     model = FoodgramUser
     list_display = (
         "id",
@@ -230,14 +239,6 @@ class FoodgramUserAdmin(UserAdmin, RecipeCountMixin):
                              f' width="50" height="50"" />')
         return "-"
 
-    @admin.display(description="Подписчики")
-    def subscriptions_count(self, user):
-        return user.subscribers.count()
-
-    @admin.display(description="Подписки")
-    def subscribers_count(self, user):
-        return user.publishers.count()
-
 
 @admin.register(Subscriber)
 class SubscriberAdmin(admin.ModelAdmin):
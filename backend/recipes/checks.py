@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии индексов ингредиентов и продуктов доходят до других
+    процессов только через общий кэш default
+    """
+    if settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        "Кэш default не общий для процессов: изменения ингредиентов и "
+        "рецептов дойдут до индексов других воркеров только через "
+        "INGREDIENT_INDEX_TTL и PANTRY_INDEX_TTL секунд.",
+        hint="Задайте DEFAULT_CACHE_BACKEND и DEFAULT_CACHE_LOCATION, "
+             "например FileBasedCache или Redis.",
+        id="recipes.W001",
+    )]
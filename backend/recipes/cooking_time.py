@@ -0,0 +1,63 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Min, Q, Subquery, Window
+from django.db.models.functions import RowNumber
+
+from .models import Recipe
+
+CACHE_KEY = "cooking_time_tertiles"
+
+Tertiles = namedtuple("Tertiles", ("n", "m", "fast", "medium", "slow",
+                                   "distinct"))
+
+
+def tertile(k):
+    """
+    Подзапрос k-й границы третей времени готовки (k = 1 или 2): значение
+    в строке floor(k * N / 3) + 1 упорядоченного списка, как у прежнего
+    times[k * len(times) // 3]. PERCENTILE_DISC даёт строку ceil(k * N / 3),
+    то есть другие границы при N, кратном трём, поэтому и в PostgreSQL
+    строка выбирается по номеру.
+    """
+    rows = Recipe.objects.order_by().annotate(
+        row=Window(RowNumber(), order_by=F("cooking_time").asc()),
+        total=Window(Count("pk")),
+    ).filter(
+        # Деление целочисленное в обеих СУБД
+        row=F("total") * k / 3 + 1
+    ).annotate(value=F("cooking_time"))
+    return Subquery(rows.values("value")[:1])
+
+
+def compute_tertiles():
+    """
+    Границы третей и число рецептов в каждой трети одним запросом
+    """
+    stats = Recipe.objects.order_by().annotate(
+        first=tertile(1), second=tertile(2)
+    ).aggregate(
+        n=Min("first"),
+        m=Min("second"),
+        fast=Count("pk", filter=Q(cooking_time__lt=F("first"))),
+        medium=Count("pk", filter=Q(cooking_time__gte=F("first"),
+                                    cooking_time__lt=F("second"))),
+        slow=Count("pk", filter=Q(cooking_time__gte=F("second"))),
+        distinct=Count("cooking_time", distinct=True),
+    )
+    return Tertiles(**stats)
+
+
+def get_tertiles():
+    tertiles = cache.get(CACHE_KEY)
+    if tertiles is None:
+        tertiles = compute_tertiles()
+        cache.set(CACHE_KEY, tuple(tertiles),
+                  timeout=settings.COOKING_TIME_TERTILES_TTL)
+        return tertiles
+    return Tertiles(*tertiles)
+
+
+def invalidate_tertiles():
+    cache.delete(CACHE_KEY)
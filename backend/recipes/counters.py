@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+from django.apps import apps as global_apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Счётчик: у объекта target в поле counter_field хранится число объектов
+# model, ссылающихся на него через field
+Counter = namedtuple("Counter", ("model", "field", "target", "counter_field"))
+
+COUNTERS = (
+    Counter("Favourite", "recipe", "Recipe", "favourites_count"),
+    Counter("Recipe", "author", "FoodgramUser", "recipes_count"),
+    Counter("Subscriber", "subscriber", "FoodgramUser",
+            "subscriptions_count"),
+    Counter("Subscriber", "publisher", "FoodgramUser", "subscribers_count"),
+)
+
+
+def counters_for(model):
+    return [counter for counter in COUNTERS
+            if counter.model == model.__name__]
+
+
+def adjust(counter, target_id, delta, apps=global_apps):
+    """
+    Атомарно меняет счётчик на delta через UPDATE ... SET x = x + delta
+    """
+    if target_id is None:
+        return
+    target = apps.get_model("recipes", counter.target)
+    target.objects.filter(pk=target_id).update(
+        **{counter.counter_field: F(counter.counter_field) + delta}
+    )
+
+
+def actual_count(counter, apps=global_apps):
+    """
+    Настоящее значение счётчика - подзапрос COUNT по связанным объектам
+    """
+    model = apps.get_model("recipes", counter.model)
+    return Coalesce(Subquery(
+        model.objects.filter(**{counter.field: OuterRef("pk")})
+        .order_by().values(counter.field)
+        .annotate(count=Count("pk")).values("count")
+    ), 0)
+
+
+def stale(counter, apps=global_apps):
+    """
+    Объекты, у которых счётчик расходится с настоящим числом
+    """
+    target = apps.get_model("recipes", counter.target)
+    return target.objects.alias(
+        actual=actual_count(counter, apps)
+    ).exclude(**{counter.counter_field: F("actual")})
+
+
+def rebuild(counter, apps=global_apps):
+    """
+    Пересчитывает расходящиеся счётчики и возвращает число
+    исправленных объектов
+    """
+    target = apps.get_model("recipes", counter.target)
+    return target.objects.filter(
+        pk__in=stale(counter, apps).values("pk")
+    ).update(**{counter.counter_field: actual_count(counter, apps)})
+
+
+def rebuild_all(apps=global_apps):
+    return sum(rebuild(counter, apps) for counter in COUNTERS)
@@ -0,0 +1,142 @@
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import (DateTimeField, F, IntegerField, Q, Value,
+                              Window)
+from django.db.models.functions import RowNumber
+
+# Столбцы FeedItem в порядке выражений запросов ниже
+COLUMNS = ("subscriber_id", "recipe_id", "author_id", "created_at")
+
+
+def insert_items(rows, apps=global_apps):
+    """
+    INSERT ... SELECT: строки ленты создаются одним запросом без
+    загрузки в Python. Уже существующие строки пропускаются.
+    """
+    model = apps.get_model("recipes", "FeedItem")
+    using = router.db_for_write(model)
+    connection = connections[using]
+    sql, params = rows.query.get_compiler(using).as_sql()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # WHERE true: SQLite иначе принимает ON CONFLICT за часть
+        # соединения в SELECT
+        cursor.execute(
+            f"INSERT INTO {quote(model._meta.db_table)} "
+            f"({', '.join(map(quote, COLUMNS))}) "
+            f"SELECT * FROM ({sql}) AS feed_rows WHERE true "
+            f"ON CONFLICT DO NOTHING",
+            params,
+        )
+        return cursor.rowcount
+
+
+def fan_out(recipe, apps=global_apps):
+    """
+    Новый рецепт в ленты подписчиков автора. Авторов, у которых
+    больше FEED_FANOUT_LIMIT подписчиков, лента читает напрямую.
+    """
+    subscriber = apps.get_model("recipes", "Subscriber")
+    return insert_items(subscriber.objects.filter(
+        publisher_id=recipe.author_id,
+        publisher__subscribers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).annotate(
+        feed_subscriber=F("subscriber_id"),
+        feed_recipe=Value(recipe.pk, IntegerField()),
+        feed_author=Value(recipe.author_id, IntegerField()),
+        feed_created_at=Value(recipe.created_at, DateTimeField()),
+    ).values_list("feed_subscriber", "feed_recipe", "feed_author",
+                  "feed_created_at"), apps)
+
+
+def backfill(subscriber_id, publisher_id, apps=global_apps):
+    """
+    После подписки в ленту попадают последние FEED_BACKFILL рецептов
+    автора
+    """
+    recipe = apps.get_model("recipes", "Recipe")
+    return insert_items(recipe.objects.filter(
+        author_id=publisher_id,
+        author__subscribers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).annotate(
+        feed_subscriber=Value(subscriber_id, IntegerField()),
+        feed_recipe=F("id"),
+        feed_author=F("author_id"),
+        feed_created_at=F("created_at"),
+    ).order_by("-created_at", "-id").values_list(
+        "feed_subscriber", "feed_recipe", "feed_author", "feed_created_at"
+    )[:settings.FEED_BACKFILL], apps)
+
+
+def latest(subscriber_id, limit, after=None, apps=global_apps):
+    """
+    Ключи (дата, id рецепта) первых limit рецептов ленты после ключа
+    after: строки FeedItem и рецепты популярных авторов, которые
+    читаются напрямую по индексу (author, -created_at)
+    """
+    feed_item = apps.get_model("recipes", "FeedItem")
+    recipe = apps.get_model("recipes", "Recipe")
+    subscriber = apps.get_model("recipes", "Subscriber")
+    items = feed_item.objects.filter(subscriber_id=subscriber_id)
+    recipes = recipe.objects.filter(
+        author__in=subscriber.objects.filter(
+            subscriber_id=subscriber_id,
+            publisher__subscribers_count__gt=settings.FEED_FANOUT_LIMIT,
+        ).values("publisher_id")
+    )
+    if after is not None:
+        created_at, recipe_id = after
+        items = items.filter(Q(created_at__lt=created_at)
+                             | Q(created_at=created_at,
+                                 recipe_id__lt=recipe_id))
+        recipes = recipes.filter(Q(created_at__lt=created_at)
+                                 | Q(created_at=created_at,
+                                     id__lt=recipe_id))
+    items = list(items.order_by("-created_at", "-recipe_id").values_list(
+        "created_at", "recipe_id"
+    )[:limit])
+    if len(items) == limit:
+        # Рецепты старше полной страницы из FeedItem на неё не попадут,
+        # и сортировать нужно только несколько новых рецептов
+        recipes = recipes.filter(created_at__gte=items[-1][0])
+    # Рецепт автора, ставшего популярным, может быть в обоих источниках
+    keys = {*items, *recipes.order_by("-created_at", "-id").values_list(
+        "created_at", "id"
+    )[:limit]}
+    return sorted(keys, reverse=True)[:limit]
+
+
+def remove(subscriber_id, publisher_id, apps=global_apps):
+    """
+    После отписки рецепты автора убираются из ленты
+    """
+    feed_item = apps.get_model("recipes", "FeedItem")
+    return feed_item.objects.filter(subscriber_id=subscriber_id,
+                                    author_id=publisher_id).delete()[0]
+
+
+def rebuild(apps=global_apps):
+    """
+    Ленты заново по всем подпискам: последние FEED_BACKFILL рецептов
+    каждого автора, как при подписке
+    """
+    feed_item = apps.get_model("recipes", "FeedItem")
+    recipe = apps.get_model("recipes", "Recipe")
+    deleted = feed_item.objects.all().delete()[0]
+    created = insert_items(recipe.objects.order_by().filter(
+        author__subscribers_count__lte=settings.FEED_FANOUT_LIMIT,
+        author__publishers__isnull=False,
+    ).annotate(
+        feed_subscriber=F("author__publishers__subscriber_id"),
+        feed_recipe=F("id"),
+        feed_author=F("author_id"),
+        feed_created_at=F("created_at"),
+        position=Window(RowNumber(),
+                        partition_by=[F("author__publishers__id")],
+                        order_by=[F("created_at").desc(), F("id").desc()]),
+    ).filter(
+        position__lte=settings.FEED_BACKFILL
+    ).values_list("feed_subscriber", "feed_recipe", "feed_author",
+                  "feed_created_at"), apps)
+    return deleted, created
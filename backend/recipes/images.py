@@ -0,0 +1,162 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Производные изображения: имя -> (размер или None для исходного, формат)
+VARIANTS = {
+    "thumbnail": (settings.IMAGE_THUMBNAIL_SIZE, "JPEG"),
+    "thumbnail_webp": (settings.IMAGE_THUMBNAIL_SIZE, "WEBP"),
+    "webp": (None, "WEBP"),
+}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                thread_name_prefix="image-variants",
+            )
+    return _executor
+
+
+def variant_name(name, variant):
+    """
+    Путь производного изображения рядом с исходным
+    """
+    path = PurePosixPath(name)
+    extension = EXTENSIONS[VARIANTS[variant][1]]
+    return str(path.parent / "variants" / f"{path.stem}_{variant}.{extension}")
+
+
+def variants_are_stale(image, variants):
+    """
+    Производные изображения не соответствуют текущему файлу
+    """
+    if not image:
+        return bool(variants)
+    return variants.get("source") != image.name
+
+
+def variant_urls(image, variants):
+    """
+    Ссылки на производные изображения. Пока они не готовы,
+    вместо них отдаётся исходное изображение.
+    """
+    if not image:
+        return None
+    ready = variants.get("source") == image.name
+    return {
+        variant: (image.storage.url(variants[variant])
+                  if ready and variant in variants else image.url)
+        for variant in VARIANTS
+    }
+
+
+def render_variant(original, size, image_format):
+    image = original.copy()
+    if size:
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=settings.IMAGE_VARIANT_QUALITY)
+    return buffer.getvalue()
+
+
+def build_variants(image):
+    """
+    Создаёт производные изображения и возвращает их пути
+    """
+    storage = image.storage
+    with storage.open(image.name, "rb") as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+
+    variants = {"source": image.name}
+    for variant, (size, image_format) in VARIANTS.items():
+        name = variant_name(image.name, variant)
+        if storage.exists(name):
+            storage.delete(name)
+        variants[variant] = storage.save(
+            name, ContentFile(render_variant(original, size, image_format))
+        )
+    return variants
+
+
+def delete_variants(image_field, variants):
+    for variant in VARIANTS:
+        if variants.get(variant):
+            image_field.storage.delete(variants[variant])
+
+
+def update_variants(instance, image_field, variants_field, force=False):
+    """
+    Приводит производные изображения объекта в соответствие с файлом.
+    Возвращает False, если изображения не менялись или файл объекта
+    успели заменить.
+    """
+    image = getattr(instance, image_field)
+    variants = getattr(instance, variants_field)
+    if not force and not variants_are_stale(image, variants):
+        return False
+
+    delete_variants(image, variants)
+    variants = build_variants(image) if image else {}
+    with transaction.atomic(using=instance._state.db):
+        # Пока строились изображения, файл могли заменить: тогда
+        # результат устарел, и сохраняет его только задача нового файла
+        current = type(instance).objects.select_for_update().filter(
+            pk=instance.pk
+        ).values_list(image_field, flat=True).first()
+        replaced = (current or "") != (image.name or "")
+        if not replaced:
+            setattr(instance, variants_field, variants)
+            # save(), а не update(): сигналы сбрасывают кэши ответов.
+            # Поля auto_now (дата изменения рецепта) тоже обновляются
+            instance.save(update_fields=[variants_field] + [
+                field.name for field in instance._meta.concrete_fields
+                if getattr(field, "auto_now", False)
+            ])
+    if replaced:
+        delete_variants(image, variants)
+    return not replaced
+
+
+def _update_in_background(model, pk, image_field, variants_field):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            update_variants(instance, image_field, variants_field)
+    except Exception:
+        logger.exception("Не удалось создать изображения для %s %s",
+                         model.__name__, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(instance, image_field, variants_field):
+    """
+    Ставит создание производных изображений в пул после коммита
+    """
+    if not variants_are_stale(getattr(instance, image_field),
+                              getattr(instance, variants_field)):
+        return
+    transaction.on_commit(lambda: get_executor().submit(
+        _update_in_background, type(instance), instance.pk,
+        image_field, variants_field,
+    ))
@@ -0,0 +1,108 @@
+import bisect
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Ingredient
+
+VERSION_KEY = "ingredient_index_version"
+
+IndexData = namedtuple("IndexData", ("ingredients", "keys", "positions",
+                                     "version", "built_at"))
+
+
+def normalize(name):
+    """
+    Приводит название к виду для сравнения без учёта регистра
+    """
+    return unicodedata.normalize("NFKC", name).casefold()
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса для поиска по началу названия.
+
+    Ингредиенты загружаются из БД при первом обращении. Ключи поиска
+    отсортированы, поэтому поиск по префиксу - два bisect'а. Результат
+    отдаётся в том же порядке, что и Ingredient.objects.all().
+
+    Изменения ингредиентов, в том числе из import_ingredients, меняют
+    версию в кэше default, и процессы перестраивают индекс при
+    следующем поиске. Для этого кэш должен быть общим для всех
+    процессов, иначе индекс других процессов обновится только через
+    INGREDIENT_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def search(self, prefix=""):
+        """
+        Ингредиенты, название которых начинается с prefix
+        """
+        return self._search(self._get_data(), prefix)
+
+    async def asearch(self, prefix=""):
+        """
+        Асинхронный search: свежий индекс используется без потоков,
+        устаревший перестраивается в отдельном потоке
+        """
+        version = await cache.aget(VERSION_KEY)
+        data = self._data
+        if data is None or self._is_stale(data, version):
+            data = await sync_to_async(self._get_data)()
+        return self._search(data, prefix)
+
+    @staticmethod
+    def _search(data, prefix):
+        if not prefix:
+            return data.ingredients
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(data.keys, prefix)
+        end = bisect.bisect_left(data.keys, prefix + chr(0x10FFFF), start)
+        return [data.ingredients[pos]
+                for pos in sorted(data.positions[start:end])]
+
+    def invalidate(self):
+        """
+        Сбрасывает индекс во всех процессах, использующих общий кэш
+        default
+        """
+        self._data = None
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+    def _get_data(self):
+        version = cache.get(VERSION_KEY)
+        data = self._data
+        if data is None or self._is_stale(data, version):
+            with self._lock:
+                data = self._data
+                if data is None or self._is_stale(data, version):
+                    data = self._data = self._build(version)
+        return data
+
+    @staticmethod
+    def _is_stale(data, version):
+        return (version != data.version
+                or time.monotonic() - data.built_at
+                > settings.INGREDIENT_INDEX_TTL)
+
+    @staticmethod
+    def _build(version):
+        ingredients = list(Ingredient.objects.all())
+        pairs = sorted((normalize(ingredient.name), pos)
+                       for pos, ingredient in enumerate(ingredients))
+        return IndexData(ingredients=ingredients,
+                         keys=[key for key, _ in pairs],
+                         positions=[pos for _, pos in pairs],
+                         version=version,
+                         built_at=time.monotonic())
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,114 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from recipes.models import (Favourite, Ingredient, Recipe, ShoppingCart,
+                            Subscriber)
+
+# Индексы из миграции 0004_access_path_indexes
+INDEXES = (
+    "recipe_created_idx",
+    "recipe_author_created_idx",
+    "favourite_recipe_author_idx",
+    "shoppingcart_recipe_author_idx",
+    "subscriber_publisher_idx",
+)
+POSTGRES_INDEXES = ("ingredient_upper_name_idx",)
+
+
+def most_frequent(model, field):
+    row = (model.objects.values(field).annotate(count=Count("pk"))
+           .order_by("-count").first())
+    return row[field] if row else None
+
+
+class Command(BaseCommand):
+    help = ("Планы и время основных запросов API без индексов "
+            "из 0004_access_path_indexes и с ними")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20,
+                            help="Сколько раз выполнять каждый запрос")
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError("В базе нет рецептов, сначала запустите "
+                               "python manage.py seed_perf_data")
+        self.repeat = options["repeat"]
+        queries = self.get_queries()
+
+        with transaction.atomic():
+            self.drop_indexes()
+            before = self.measure(queries)
+            # Откат транзакции возвращает удалённые индексы
+            transaction.set_rollback(True)
+        after = self.measure(queries)
+
+        for title in queries:
+            (plan_before, time_before) = before[title]
+            (plan_after, time_after) = after[title]
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(f"  без индексов: {time_before:.2f} мс")
+            self.stdout.write(self.indent(plan_before))
+            self.stdout.write(f"  с индексами: {time_after:.2f} мс")
+            self.stdout.write(self.indent(plan_after))
+
+    @staticmethod
+    def get_queries():
+        """
+        Запросы, повторяющие фильтры и сортировки представлений API
+        """
+        author = most_frequent(Recipe, "author")
+        publisher = most_frequent(Subscriber, "publisher")
+        recipe = most_frequent(Favourite, "recipe")
+        user = most_frequent(ShoppingCart, "author")
+        prefix = Ingredient.objects.values_list("name", flat=True).first()
+        return {
+            "Лента рецептов": Recipe.objects.order_by(
+                "-created_at", "-id"
+            )[:10],
+            "Рецепты автора (?author=)": Recipe.objects.filter(
+                author=author
+            )[:10],
+            "Подписчики автора": Subscriber.objects.filter(
+                publisher=publisher
+            ).values_list("subscriber", flat=True),
+            "Кто добавил рецепт в избранное": Favourite.objects.filter(
+                recipe=recipe
+            ).values_list("author", flat=True),
+            "Список покупок (?is_in_shopping_cart=1)": Recipe.objects.filter(
+                shoppingcarts__author=user
+            )[:10],
+            "Поиск ингредиента по началу названия": Ingredient.objects.filter(
+                name__istartswith=(prefix or "")[:3]
+            ),
+        }
+
+    def drop_indexes(self):
+        names = INDEXES
+        if connection.vendor == "postgresql":
+            names += POSTGRES_INDEXES
+        with connection.cursor() as cursor:
+            for name in names:
+                cursor.execute(
+                    f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}"
+                )
+
+    def measure(self, queries):
+        results = {}
+        for title, queryset in queries.items():
+            timings = []
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[title] = (queryset.explain(),
+                              statistics.median(timings))
+        return results
+
+    @staticmethod
+    def indent(plan):
+        return "\n".join(f"    {line}" for line in plan.splitlines())
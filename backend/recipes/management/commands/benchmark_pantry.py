@@ -0,0 +1,197 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from recipes.models import Ingredient, RecipeIngredient
+from recipes.pantry_index import PantryIndex, PantryPostings
+
+# Столько ингредиентов в data/ingredients.csv
+DEFAULT_INGREDIENTS = 2186
+
+
+def sql_matches(ingredient_ids, max_missing):
+    """
+    Тот же поиск одним запросом с группировкой RecipeIngredient
+    """
+    return list(
+        RecipeIngredient.objects.values("recipe_id").annotate(
+            total=Count("id"),
+            hits=Count("id", filter=Q(ingredient_id__in=ingredient_ids)),
+        ).filter(
+            hits__gt=0, total__lte=F("hits") + max_missing
+        ).annotate(
+            coverage=Cast("hits", FloatField()) / F("total"),
+            missing=F("total") - F("hits"),
+        ).order_by(
+            "-coverage", "missing", "-recipe_id"
+        ).values_list("recipe_id", flat=True)
+    )
+
+
+def milliseconds(timings):
+    timings = sorted(timings)
+    return (statistics.median(timings) * 1000,
+            timings[int(len(timings) * 0.99)] * 1000)
+
+
+class Command(BaseCommand):
+    help = ("Поиск рецептов по имеющимся продуктам: индекс в памяти "
+            "на синтетических данных и сравнение с SQL на данных из БД")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=1_000_000,
+                            help="Число синтетических рецептов")
+        parser.add_argument("--queries", type=int, default=200,
+                            help="Число поисков")
+        parser.add_argument("--pantry", type=int, default=20,
+                            help="Продуктов в одном поиске")
+        parser.add_argument("--missing", type=int, default=2,
+                            help="Допустимое число недостающих продуктов")
+        parser.add_argument("--changed", type=int, default=1000,
+                            help="Изменённых рецептов для проверки "
+                                 "добавки к индексу")
+        parser.add_argument("--zipf", type=float, default=0,
+                            help="Показатель популярности продуктов; "
+                                 "0 - равномерно, как в seed_perf_data")
+        parser.add_argument("--sql", type=int, default=0, metavar="N",
+                            help="Сравнить N поисков с SQL на данных БД")
+        parser.add_argument("--seed", type=int, default=42,
+                            help="Начальное значение генератора")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = np.random.default_rng(options["seed"])
+        ingredient_ids = np.array(
+            Ingredient.objects.values_list("id", flat=True)
+        ) if Ingredient.objects.exists() else np.arange(
+            1, DEFAULT_INGREDIENTS + 1
+        )
+        weights = 1 / np.arange(1, len(ingredient_ids) + 1) ** options["zipf"]
+        self.weights = weights / weights.sum()
+        self.ingredient_ids = ingredient_ids
+
+        self.benchmark_synthetic()
+        if options["sql"]:
+            self.benchmark_sql()
+
+    def pantries(self, count):
+        return [
+            self.rng.choice(self.ingredient_ids, self.options["pantry"],
+                            replace=False, p=self.weights)
+            for _ in range(count)
+        ]
+
+    def benchmark_synthetic(self):
+        options = self.options
+        count = options["recipes"]
+        # Как в seed_perf_data: в среднем 7 продуктов, редко больше 20
+        sizes = np.clip(np.rint(self.rng.lognormal(1.9, 0.45, count)),
+                        1, 30).astype(np.int64)
+        recipe_ids = np.repeat(np.arange(1, count + 1), sizes)
+        ingredients = self.rng.choice(self.ingredient_ids, len(recipe_ids),
+                                      p=self.weights)
+        # Повторы продукта в рецепте отбрасываются
+        pairs = np.unique(np.stack([recipe_ids, ingredients]), axis=1)
+
+        started = time.perf_counter()
+        state = PantryIndex.make_state(PantryPostings(pairs[1], pairs[0]))
+        built = time.perf_counter() - started
+        base = state.base
+        size = sum(array.nbytes for array in (
+            base.recipes, base.sizes, base.ingredients, base.offsets,
+            base.positions, state.alive,
+        ))
+        self.stdout.write(
+            f"Рецептов: {count}, связей с продуктами: {pairs.shape[1]}, "
+            f"индекс {size / 2 ** 20:.1f} МБ, построен за {built:.2f} с"
+        )
+
+        timings, found = self.run_queries(state, self.pantries(
+            options["queries"]
+        ))
+        p50, p99 = milliseconds(timings)
+        self.stdout.write(
+            f"Поиск {options['pantry']} продуктов, не хватает "
+            f"<= {options['missing']}: p50 {p50:.1f} мс, p99 {p99:.1f} мс, "
+            f"в среднем найдено {statistics.mean(found):.0f}"
+        )
+
+        changed = self.rng.choice(count, options["changed"],
+                                  replace=False) + 1
+        started = time.perf_counter()
+        patched = PantryIndex.patch(state, {
+            int(recipe_id): frozenset(self.rng.choice(
+                self.ingredient_ids, 7, replace=False
+            ).tolist())
+            for recipe_id in changed
+        })
+        patch_time = time.perf_counter() - started
+        timings, _ = self.run_queries(patched, self.pantries(
+            options["queries"]
+        ))
+        p50, p99 = milliseconds(timings)
+        self.stdout.write(
+            f"Изменено {options['changed']} рецептов: добавка за "
+            f"{patch_time * 1000:.0f} мс, поиск p50 {p50:.1f} мс, "
+            f"p99 {p99:.1f} мс"
+        )
+
+        started = time.perf_counter()
+        merged = PantryPostings(*patched.base.pairs(patched.alive))
+        self.stdout.write(
+            f"Слияние добавки с индексом: "
+            f"{time.perf_counter() - started:.2f} с "
+            f"({len(merged.recipes)} рецептов)"
+        )
+
+    def run_queries(self, state, pantries):
+        timings = []
+        found = []
+        for pantry in pantries:
+            started = time.perf_counter()
+            matches = PantryIndex.match_state(state, pantry,
+                                              self.options["missing"])
+            timings.append(time.perf_counter() - started)
+            found.append(len(matches.recipe_ids))
+        return timings, found
+
+    def benchmark_sql(self):
+        """
+        Индекс из БД против группировки в SQL: время и совпадение
+        результатов
+        """
+        if not RecipeIngredient.objects.exists():
+            raise CommandError("В базе нет рецептов, сначала запустите "
+                               "python manage.py seed_perf_data")
+        started = time.perf_counter()
+        state = PantryIndex.make_state(PantryPostings.from_db())
+        self.stdout.write(
+            f"Индекс из БД: {len(state.base.recipes)} рецептов за "
+            f"{time.perf_counter() - started:.1f} с"
+        )
+
+        index_timings = []
+        sql_timings = []
+        for pantry in self.pantries(self.options["sql"]):
+            started = time.perf_counter()
+            matches = PantryIndex.match_state(state, pantry,
+                                              self.options["missing"])
+            index_timings.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            expected = sql_matches(pantry.tolist(), self.options["missing"])
+            sql_timings.append(time.perf_counter() - started)
+            if matches.recipe_ids.tolist() != expected:
+                raise CommandError("Индекс и SQL нашли разные рецепты "
+                                   f"для продуктов {pantry.tolist()}")
+
+        for title, timings in (("индекс", index_timings),
+                               ("SQL", sql_timings)):
+            p50, p99 = milliseconds(timings)
+            self.stdout.write(f"{title}: p50 {p50:.1f} мс, p99 {p99:.1f} мс")
+        self.stdout.write(self.style.SUCCESS(
+            "Индекс и SQL нашли одни и те же рецепты в том же порядке"
+        ))
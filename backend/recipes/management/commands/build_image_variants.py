@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes.images import update_variants
+from recipes.models import FoodgramUser, Recipe
+
+TARGETS = (
+    (Recipe, "image", "image_variants"),
+    (FoodgramUser, "avatar", "avatar_variants"),
+)
+
+
+class Command(BaseCommand):
+    help = ("Создание уменьшенных копий и WebP-версий для уже "
+            "загруженных изображений рецептов и аватарок")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=settings.IMAGE_VARIANT_WORKERS,
+            help="Число параллельных потоков"
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Пересоздать копии, даже если они уже есть"
+        )
+
+    def handle(self, *args, **options):
+        results = {"created": 0, "skipped": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = [
+                pool.submit(self.process, model, pk, image_field,
+                            variants_field, options["force"])
+                for model, image_field, variants_field in TARGETS
+                for pk in (model.objects
+                           .exclude(**{image_field: ""})
+                           .exclude(**{f"{image_field}__isnull": True})
+                           .values_list("pk", flat=True))
+            ]
+            for future in as_completed(futures):
+                results[future.result()] += 1
+
+        style = self.style.ERROR if results["failed"] else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Создано: {results["created"]}, '
+            f'без изменений: {results["skipped"]}, '
+            f'ошибок: {results["failed"]}'
+        ))
+
+    def process(self, model, pk, image_field, variants_field, force):
+        try:
+            instance = model.objects.get(pk=pk)
+            updated = update_variants(instance, image_field, variants_field,
+                                      force=force)
+            return "created" if updated else "skipped"
+        except Exception as e:
+            self.stderr.write(f"{model.__name__} {pk}: {e}")
+            return "failed"
+        finally:
+            connections.close_all()
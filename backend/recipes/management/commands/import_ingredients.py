@@ -1,28 +1,223 @@
+import csv
 import json
+import re
+import time
+import unicodedata
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
 
-from recipes.models import Ingredient
+from api.cache import recipe_response_cache
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Ingredient, Recipe
+
+DEFAULT_FILE = "data/ingredients.json"
+FORMATS = ("csv", "json")
+CSV_HEADER = ["name", "measurement_unit"]
+READ_SIZE = 64 * 1024
+JSON_SEPARATORS = re.compile(r"[\s\[\],]*")
+
+NAME_LENGTH = Ingredient._meta.get_field("name").max_length
+UNIT_LENGTH = Ingredient._meta.get_field("measurement_unit").max_length
+
+
+def normalize_name(name):
+    """
+    Название без лишних пробелов и в нижнем регистре, чтобы
+    «Сахар », «сахар» и «САХАР» считались одним ингредиентом
+    """
+    return " ".join(unicodedata.normalize("NFKC", name).split()).lower()
+
+
+def read_csv(f):
+    for row in csv.reader(f):
+        if [value.strip() for value in row] == CSV_HEADER:
+            continue
+        yield row[:2] if len(row) >= 2 else None
+
+
+def read_json(f):
+    """
+    Читает JSON-массив (или JSON Lines) по одному объекту,
+    не загружая файл в память целиком
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    while True:
+        pos = JSON_SEPARATORS.match(buffer, pos).end()
+        if not eof and len(buffer) - pos < READ_SIZE:
+            chunk = f.read(READ_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        if pos == len(buffer):
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Объект длиннее прочитанного фрагмента
+            chunk = f.read(READ_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        yield ((item.get("name"), item.get("measurement_unit"))
+               if isinstance(item, dict) else None)
+
+
+READERS = {"csv": read_csv, "json": read_json}
 
 
 class Command(BaseCommand):
-    help = 'Импорт ингредиентов из JSON-файла'
+    help = "Импорт ингредиентов из CSV- или JSON-файлов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "files", nargs="*", default=[DEFAULT_FILE],
+            help=f"Файлы с ингредиентами (по умолчанию {DEFAULT_FILE})"
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Формат файлов; по умолчанию определяется по расширению"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Число строк, сохраняемых в одной транзакции"
+        )
+        parser.add_argument(
+            "--update-units", action="store_true",
+            help=("Обновлять единицу измерения, если ингредиент с таким "
+                  "названием уже есть в единственном экземпляре")
+        )
 
     def handle(self, *args, **options):
-        filename = 'data/ingredients.json'
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть больше нуля")
+
+        totals = dict.fromkeys(("rows", "created", "updated", "skipped"), 0)
+        updated_ids = []
+        started = time.monotonic()
+        self.legacy = self.load_legacy()
+        try:
+            for filename in options["files"]:
+                self.import_file(filename, options, totals, updated_ids)
+        finally:
+            if totals["created"] or totals["updated"]:
+                ingredient_index.invalidate()
+            if updated_ids:
+                # bulk_update не вызывает сигналы сохранения ингредиента
+                Recipe.objects.filter(
+                    ingredients__in=updated_ids
+                ).update(updated_at=now())
+                recipe_response_cache.bump()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано ингредиентов: {totals["created"]}, '
+            f'обновлено: {totals["updated"]}, '
+            f'пропущено строк: {totals["skipped"]} '
+            f'из {totals["rows"]} за {elapsed:.2f} с'
+        ))
+
+    def import_file(self, filename, options, totals, updated_ids):
+        path = Path(filename)
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f"Не удалось определить формат файла {filename}, "
+                f"укажите --format"
+            )
 
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                before_count = Ingredient.objects.count()
-                Ingredient.objects.bulk_create([
-                    Ingredient(**item) for item in json.load(f)
-                ], ignore_conflicts=True)
-
-                self.stdout.write(self.style.SUCCESS(
-                    f'Импортировано ингредиентов: {Ingredient.objects.count()
-                                                   - before_count}'
-                ))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(
-                f'Ошибка при импорте из файла {filename}: {str(e)}'
-            ))
+            with path.open(encoding="utf-8", newline="") as f:
+                rows = READERS[file_format](f)
+                number = 0
+                while batch := list(islice(rows, options["batch_size"])):
+                    number += 1
+                    started = time.monotonic()
+                    created, updated, skipped = self.save_batch(
+                        batch, options["update_units"], updated_ids
+                    )
+                    elapsed = time.monotonic() - started
+                    totals["rows"] += len(batch)
+                    totals["created"] += created
+                    totals["updated"] += updated
+                    totals["skipped"] += skipped
+                    if options["verbosity"] > 1:
+                        self.stdout.write(
+                            f"{path.name}, пакет {number}: "
+                            f"{len(batch)} строк, создано {created}, "
+                            f"обновлено {updated} за {elapsed:.3f} с "
+                            f"({len(batch) / max(elapsed, 1e-6):.0f} строк/с)"
+                        )
+        except OSError as e:
+            raise CommandError(f"Не удалось прочитать {filename}: {e}")
+        except (json.JSONDecodeError, UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(f"Ошибка в файле {filename}: {e}")
+
+    @staticmethod
+    def clean_batch(batch):
+        """
+        Нормализованные пары (название, мера) без повторов
+        и количество отброшенных строк
+        """
+        items = {}
+        for row in batch:
+            if row is None:
+                continue
+            name, unit = row
+            if not isinstance(name, str) or not isinstance(unit, str):
+                continue
+            name, unit = normalize_name(name), " ".join(unit.split())
+            if (name and unit and len(name) <= NAME_LENGTH
+                    and len(unit) <= UNIT_LENGTH):
+                items.setdefault((name, unit), None)
+        return list(items), len(batch) - len(items)
+
+    @staticmethod
+    def load_legacy():
+        """
+        Ингредиенты с ненормализованными названиями («Сахар»), которые
+        нельзя найти по точному совпадению, по нормализованному
+        названию. Импорт пишет только нормализованные названия, поэтому
+        их список за время импорта не растёт.
+        """
+        legacy = {}
+        for ingredient in Ingredient.objects.order_by("pk").iterator(
+            chunk_size=10000
+        ):
+            name = normalize_name(ingredient.name)
+            if name != ingredient.name:
+                legacy.setdefault(name, []).append(ingredient)
+        return legacy
+
+    def save_batch(self, batch, update_units, updated_ids):
+        items, skipped = self.clean_batch(batch)
+        with transaction.atomic():
+            names = {name for name, _ in items}
+            units = {name: list(self.legacy[name])
+                     for name in names & self.legacy.keys()}
+            for ingredient in Ingredient.objects.filter(name__in=names):
+                units.setdefault(ingredient.name, []).append(ingredient)
+
+            to_create, to_update = [], []
+            for name, unit in items:
+                existing = units.get(name, [])
+                if any(i.measurement_unit == unit for i in existing):
+                    skipped += 1
+                elif (update_units and len(existing) == 1
+                      and existing[0].pk is not None
+                      and existing[0] not in to_update):
+                    existing[0].measurement_unit = unit
+                    to_update.append(existing[0])
+                else:
+                    ingredient = Ingredient(name=name, measurement_unit=unit)
+                    to_create.append(ingredient)
+                    units.setdefault(name, []).append(ingredient)
+
+            Ingredient.objects.bulk_create(to_create, ignore_conflicts=True)
+            Ingredient.objects.bulk_update(to_update, ["measurement_unit"])
+        updated_ids.extend(ingredient.pk for ingredient in to_update)
+        return len(to_create), len(to_update), skipped
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = ("Проверка и пересчёт счётчиков избранного, рецептов, "
+            "подписок и подписчиков")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Только проверить, без исправления"
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for counter in counters.COUNTERS:
+            title = f"{counter.target}.{counter.counter_field}"
+            if options["check"]:
+                stale = counters.stale(counter)
+                count = stale.count()
+                sample = list(stale.values_list("pk", flat=True)[:10])
+                details = f" (например, id {sample})" if sample else ""
+                self.stdout.write(f"{title}: расходится {count}{details}")
+            else:
+                with transaction.atomic():
+                    count = counters.rebuild(counter)
+                self.stdout.write(f"{title}: исправлено {count}")
+            total += count
+
+        if options["check"] and total:
+            raise CommandError(f"Счётчики расходятся у {total} объектов, "
+                               f"запустите rebuild_counters")
+        self.stdout.write(self.style.SUCCESS(
+            "Счётчики пересчитаны" if not options["check"]
+            else "Счётчики совпадают"
+        ))
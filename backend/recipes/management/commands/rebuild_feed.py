@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import feed
+
+
+class Command(BaseCommand):
+    help = ("Пересборка лент подписок: после массовых изменений без "
+            "сигналов или изменения FEED_FANOUT_LIMIT и FEED_BACKFILL")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            deleted, created = feed.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ленты пересобраны: удалено {deleted}, создано {created}"
+        ))
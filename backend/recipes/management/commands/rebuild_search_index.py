@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError, connection
+
+from recipes.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = ("Восстановление полнотекстового индекса рецептов: столбец "
+            "search_vector в PostgreSQL, таблица FTS5 и её триггеры "
+            "в SQLite")
+
+    def handle(self, *args, **options):
+        try:
+            with connection.schema_editor() as editor:
+                install_search_index(editor)
+        except NotSupportedError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            "Поисковый индекс рецептов восстановлен"
+        ))
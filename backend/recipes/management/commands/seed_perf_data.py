@@ -0,0 +1,246 @@
+import random
+import time
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import recipe_response_cache
+from recipes import counters, feed
+from recipes.models import (Favourite, FeedItem, FoodgramUser, Ingredient,
+                            Recipe, RecipeIngredient, ShoppingCart,
+                            Subscriber)
+from recipes.pantry_index import pantry_index
+
+PASSWORD = "perf-password"
+IMAGE_NAME = "recipes/perf.gif"
+# Прозрачный GIF 1x1, чтобы ссылки на изображения рецептов работали
+IMAGE = (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!"
+         b"\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00"
+         b"\x00\x02\x02D\x01\x00;")
+
+FIRST_NAMES = ("Анна", "Иван", "Мария", "Пётр", "Ольга", "Дмитрий",
+               "Елена", "Сергей", "Наталья", "Алексей")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев",
+              "Петров", "Соколов", "Михайлов", "Новиков", "Фёдоров")
+DISHES = ("Суп", "Салат", "Пирог", "Рагу", "Каша", "Запеканка",
+          "Омлет", "Паста", "Плов", "Блины")
+TEXT = ("Нарезать ингредиенты, смешать и готовить до готовности. "
+        "Подавать горячим.")
+
+
+def zipf_weights(count, exponent):
+    """
+    Накопленные веса степенного распределения: первые элементы
+    выбираются намного чаще последних
+    """
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = ("Генерация пользователей, рецептов, избранного, списков "
+            "покупок и подписок для нагрузочного тестирования")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000,
+                            help="Число пользователей")
+        parser.add_argument("--recipes", type=int, default=10000,
+                            help="Число рецептов")
+        parser.add_argument("--favourites", type=float, default=20,
+                            help="Среднее число избранных рецептов")
+        parser.add_argument("--carts", type=float, default=5,
+                            help="Среднее число рецептов в списке покупок")
+        parser.add_argument("--subscriptions", type=float, default=10,
+                            help="Среднее число подписок")
+        parser.add_argument("--zipf", type=float, default=1.1,
+                            help="Показатель степенного распределения "
+                                 "популярности авторов и рецептов")
+        parser.add_argument("--seed", type=int, default=42,
+                            help="Начальное значение генератора случайных "
+                                 "чисел")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Число строк в одном INSERT")
+        parser.add_argument("--prefix", default="perf",
+                            help="Префикс ников и почты пользователей")
+        parser.add_argument("--clear", action="store_true",
+                            help="Удалить ранее созданные данные с этим "
+                                 "префиксом")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        prefix = options["prefix"]
+        users = FoodgramUser.objects.filter(username__startswith=f"{prefix}_")
+
+        if options["clear"]:
+            self.clear(users)
+        elif users.exists():
+            raise CommandError(
+                f"Пользователи с префиксом {prefix} уже есть, "
+                f"укажите --clear или другой --prefix"
+            )
+        ingredient_ids = list(Ingredient.objects.values_list("pk", flat=True))
+        if not ingredient_ids:
+            raise CommandError("Сначала загрузите ингредиенты: "
+                               "python manage.py import_ingredients")
+        if options["users"] < 2 or options["recipes"] < 1:
+            raise CommandError("Нужно хотя бы 2 пользователя и 1 рецепт")
+
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, ContentFile(IMAGE))
+
+        started = time.monotonic()
+        self.insert(FoodgramUser, self.generate_users(prefix, options))
+        user_ids = list(users.order_by("pk").values_list("pk", flat=True))
+        # Популярность авторов и рецептов - по степенному закону
+        self.rng.shuffle(user_ids)
+        author_weights = zipf_weights(len(user_ids), options["zipf"])
+
+        self.insert(Recipe, self.generate_recipes(
+            user_ids, author_weights, options["recipes"]
+        ))
+        recipe_ids = list(Recipe.objects.filter(
+            author__username__startswith=f"{prefix}_"
+        ).order_by("pk").values_list("pk", flat=True))
+        self.rng.shuffle(recipe_ids)
+        recipe_weights = zipf_weights(len(recipe_ids), options["zipf"])
+
+        self.insert(RecipeIngredient,
+                    self.generate_ingredients(recipe_ids, ingredient_ids))
+        for model, option in ((Favourite, "favourites"),
+                              (ShoppingCart, "carts")):
+            self.insert(model, self.generate_relations(
+                user_ids, options[option], len(recipe_ids),
+                lambda user, pos: model(author_id=user,
+                                        recipe_id=recipe_ids[pos]),
+                recipe_weights,
+            ))
+        self.insert(Subscriber, self.generate_relations(
+            user_ids, options["subscriptions"], len(user_ids),
+            lambda user, pos: (Subscriber(subscriber_id=user,
+                                          publisher_id=user_ids[pos])
+                               if user != user_ids[pos] else None),
+            author_weights,
+        ))
+        # bulk_create и _raw_delete не вызывают сигналы счётчиков и лент
+        self.rebuild_counters()
+        self.rebuild_feeds()
+        recipe_response_cache.bump()
+        pantry_index.invalidate(rebuild=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Данные созданы за {time.monotonic() - started:.1f} с"
+        ))
+
+    def clear(self, users):
+        """
+        Удаляет сгенерированные данные. Каскадное удаление через ORM
+        загружает каждую строку ради сигналов, поэтому большие таблицы
+        очищаются одним DELETE.
+        """
+        recipes = Recipe.objects.filter(author__in=users)
+        querysets = (
+            FeedItem.objects.filter(recipe__in=recipes),
+            FeedItem.objects.filter(subscriber__in=users),
+            RecipeIngredient.objects.filter(recipe__in=recipes),
+            Favourite.objects.filter(recipe__in=recipes),
+            Favourite.objects.filter(author__in=users),
+            ShoppingCart.objects.filter(recipe__in=recipes),
+            ShoppingCart.objects.filter(author__in=users),
+            Subscriber.objects.filter(subscriber__in=users),
+            Subscriber.objects.filter(publisher__in=users),
+            recipes,
+        )
+        with transaction.atomic():
+            deleted = sum(queryset._raw_delete(queryset.db)
+                          for queryset in querysets)
+            deleted += users.delete()[0]
+        pantry_index.invalidate(rebuild=True)
+        self.stdout.write(f"Удалено строк: {deleted}")
+
+    def rebuild_counters(self):
+        started = time.monotonic()
+        with transaction.atomic():
+            changed = counters.rebuild_all()
+        self.stdout.write(f"Счётчики: {changed} за "
+                          f"{time.monotonic() - started:.1f} с")
+
+    def rebuild_feeds(self):
+        started = time.monotonic()
+        with transaction.atomic():
+            _, created = feed.rebuild()
+        self.stdout.write(f"Ленты: {created} записей за "
+                          f"{time.monotonic() - started:.1f} с")
+
+    def insert(self, model, objects):
+        """
+        Сохраняет объекты пачками по batch_size, каждая в своей транзакции
+        """
+        started = time.monotonic()
+        total = 0
+        while batch := list(islice(objects, self.batch_size)):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            total += len(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{model.__name__}: {total} за {elapsed:.1f} с "
+            f"({total / max(elapsed, 1e-6):.0f} строк/с)"
+        )
+
+    def generate_users(self, prefix, options):
+        # Хеширование пароля медленное, поэтому хеш один на всех
+        password = make_password(PASSWORD)
+        for number in range(options["users"]):
+            yield FoodgramUser(
+                username=f"{prefix}_{number}",
+                email=f"{prefix}_{number}@example.com",
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+            )
+
+    def generate_recipes(self, user_ids, weights, count):
+        authors = self.rng.choices(user_ids, cum_weights=weights, k=count)
+        for number, author in enumerate(authors):
+            yield Recipe(
+                author_id=author,
+                name=f"{self.rng.choice(DISHES)} №{number}",
+                text=TEXT,
+                cooking_time=max(1, round(self.rng.lognormvariate(3.3, 0.6))),
+                image=IMAGE_NAME,
+            )
+
+    def generate_ingredients(self, recipe_ids, ingredient_ids):
+        for recipe in recipe_ids:
+            # В среднем 7 ингредиентов, редко больше 20
+            count = min(len(ingredient_ids), 30,
+                        max(1, round(self.rng.lognormvariate(1.9, 0.45))))
+            for ingredient in self.rng.sample(ingredient_ids, count):
+                yield RecipeIngredient(recipe_id=recipe,
+                                       ingredient_id=ingredient,
+                                       amount=self.rng.randint(1, 500))
+
+    def generate_relations(self, user_ids, mean, size, build, weights):
+        """
+        Для каждого пользователя около mean связей с популярными
+        объектами; число связей распределено экспоненциально
+        """
+        for user in user_ids:
+            count = min(size, round(self.rng.expovariate(1 / mean))
+                        if mean > 0 else 0)
+            chosen = set()
+            # Популярные объекты часто повторяются, поэтому попыток больше
+            for _ in range(count * 4):
+                if len(chosen) >= count:
+                    break
+                chosen.add(self.rng.choices(range(size),
+                                            cum_weights=weights)[0])
+            for pos in chosen:
+                relation = build(user, pos)
+                if relation is not None:
+                    yield relation
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:10
+
+from django.db import DatabaseError, migrations, models, transaction
+
+INGREDIENT_NAME_INDEX = "ingredient_upper_name_idx"
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    """
+    Индекс для поиска ингредиентов без учёта регистра: Django строит
+    условие UPPER("name"::text) LIKE UPPER(...). Триграммный индекс
+    подходит и для istartswith, и для icontains (поиск в админке).
+    Без прав на расширение pg_trgm создаётся B-tree индекс, которого
+    хватает для поиска по началу названия. В SQLite LIKE по выражению
+    индекс не использует, поэтому там ничего не создаётся.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = apps.get_model("recipes", "Ingredient")._meta.db_table
+    expression = 'UPPER("name"::text)'
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            index = f"USING gin ({expression} gin_trgm_ops)"
+    except DatabaseError:
+        index = f"({expression} text_pattern_ops)"
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS "{INGREDIENT_NAME_INDEX}" '
+        f'ON "{table}" {index}'
+    )
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS "{INGREDIENT_NAME_INDEX}"'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0003_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(fields=["-created_at", "-id"],
+                               name="recipe_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(fields=["author", "-created_at"],
+                               name="recipe_author_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="favourite",
+            index=models.Index(fields=["recipe", "author"],
+                               name="favourite_recipe_author_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="shoppingcart",
+            index=models.Index(fields=["recipe", "author"],
+                               name="shoppingcart_recipe_author_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="subscriber",
+            index=models.Index(fields=["publisher", "subscriber"],
+                               name="subscriber_publisher_idx"),
+        ),
+        migrations.RunPython(create_ingredient_name_index,
+                             drop_ingredient_name_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ("Favourite", "recipe", "Recipe", "favourites_count"),
+    ("Recipe", "author", "FoodgramUser", "recipes_count"),
+    ("Subscriber", "subscriber", "FoodgramUser", "subscriptions_count"),
+    ("Subscriber", "publisher", "FoodgramUser", "subscribers_count"),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, field, target_name, counter_field in COUNTERS:
+        model = apps.get_model("recipes", model_name)
+        target = apps.get_model("recipes", target_name)
+        target.objects.update(**{counter_field: Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by().values(field)
+            .annotate(count=Count("pk")).values("count")
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0004_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foodgramuser",
+            name="recipes_count",
+            field=models.IntegerField(default=0, editable=False,
+                                      verbose_name="Число рецептов"),
+        ),
+        migrations.AddField(
+            model_name="foodgramuser",
+            name="subscriptions_count",
+            field=models.IntegerField(default=0, editable=False,
+                                      verbose_name="Подписки"),
+        ),
+        migrations.AddField(
+            model_name="foodgramuser",
+            name="subscribers_count",
+            field=models.IntegerField(default=0, editable=False,
+                                      verbose_name="Подписчики"),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="favourites_count",
+            field=models.IntegerField(default=0, editable=False,
+                                      verbose_name="В избранном"),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
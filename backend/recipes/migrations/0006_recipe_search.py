@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:40
+
+from django.db import migrations
+
+from recipes.search import drop_search_index, install_search_index
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Полнотекстовый индекс рецептов. В PostgreSQL это вычисляемый столбец
+    search_vector с GIN-индексом, в SQLite - таблица FTS5 с триггерами.
+    Обе СУБД сами обновляют индекс при любом изменении рецептов,
+    в том числе через bulk_create и QuerySet.update().
+    """
+    install_search_index(schema_editor)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0005_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from recipes import feed
+
+
+def fill_feeds(apps, schema_editor):
+    feed.rebuild(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0007_recipe_updated_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FeedItem",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name="ID")),
+                ("created_at", models.DateTimeField(
+                    verbose_name="Дата создания рецепта")),
+                ("author", models.ForeignKey(
+                    db_index=False,
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name="+",
+                    to=settings.AUTH_USER_MODEL,
+                    verbose_name="Автор")),
+                ("recipe", models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name="feed_items",
+                    to="recipes.recipe",
+                    verbose_name="Рецепт")),
+                ("subscriber", models.ForeignKey(
+                    db_index=False,
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name="feed_items",
+                    to=settings.AUTH_USER_MODEL,
+                    verbose_name="Подписчик")),
+            ],
+            options={
+                "verbose_name": "Лента",
+                "verbose_name_plural": "Ленты",
+                "indexes": [
+                    models.Index(
+                        fields=["subscriber", "-created_at", "-recipe"],
+                        name="feeditem_subscriber_idx"),
+                    models.Index(fields=["author", "subscriber"],
+                                 name="feeditem_author_idx"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("subscriber", "recipe"),
+                        name="unique_feed_item"),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -47,6 +47,19 @@ class FoodgramUser(AbstractUser):
                                blank=True,
                                upload_to="avatars/",
                                verbose_name="Аватарка")
+    avatar_variants = models.JSONField(default=dict,
+                                       blank=True,
+                                       editable=False,
+                                       verbose_name="Уменьшенные аватарки")
+    recipes_count = models.IntegerField(default=0,
+                                        editable=False,
+                                        verbose_name="Число рецептов")
+    subscriptions_count = models.IntegerField(default=0,
+                                              editable=False,
+                                              verbose_name="Подписки")
+    subscribers_count = models.IntegerField(default=0,
+                                            editable=False,
+                                            verbose_name="Подписчики")
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["first_name", "last_name", "username"]
@@ -92,10 +105,25 @@ class Recipe(models.Model):
         upload_to="recipes/",
         verbose_name="Изображение"
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Уменьшенные изображения"
+    )
+    favourites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name="В избранном"
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Дата создания"
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата изменения"
+    )
 
     def __str__(self):
         return self.name
@@ -109,6 +137,15 @@ class Recipe(models.Model):
                 name="unique_recipe_per_author"
             )
         ]
+        indexes = [
+            # Лента рецептов и рецепты автора - от новых
+            models.Index(fields=["-created_at", "-id"],
+                         name="recipe_created_idx"),
+            models.Index(fields=["author", "-created_at"],
+                         name="recipe_author_created_idx"),
+            # Сверка индекса продуктов с изменёнными рецептами
+            models.Index(fields=["updated_at"], name="recipe_updated_idx"),
+        ]
         ordering = ("-created_at",)  # от новых
 
 
@@ -167,6 +204,10 @@ class BaseUserRecipeRelation(models.Model):
                 name="unique_%(class)s"
             )
         ]
+        indexes = [
+            models.Index(fields=["recipe", "author"],
+                         name="%(class)s_recipe_author_idx"),
+        ]
 
     def __str__(self):
         return f"{self.author} - {self.recipe}"
@@ -213,5 +254,54 @@ class Subscriber(models.Model):
                 name="unique_subscription"
             )
         ]
+        indexes = [
+            models.Index(fields=["publisher", "subscriber"],
+                         name="subscriber_publisher_idx"),
+        ]
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписчика. Строки создаются при публикации рецепта
+    для каждого подписчика автора (кроме авторов с очень большим числом
+    подписчиков, их рецепты лента читает напрямую) и при подписке.
+    """
+    subscriber = models.ForeignKey(FoodgramUser,
+                                   on_delete=models.CASCADE,
+                                   related_name="feed_items",
+                                   # Покрывается индексами ниже
+                                   db_index=False,
+                                   verbose_name="Подписчик")
+    author = models.ForeignKey(FoodgramUser,
+                               on_delete=models.CASCADE,
+                               related_name="+",
+                               db_index=False,
+                               verbose_name="Автор")
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name="feed_items",
+                               verbose_name="Рецепт")
+    # Копия даты рецепта: лента читается по индексу без соединения
+    created_at = models.DateTimeField(verbose_name="Дата создания рецепта")
+
+    def __str__(self):
+        return f"{self.subscriber} - {self.recipe}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subscriber", "recipe"],
+                name="unique_feed_item"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["subscriber", "-created_at", "-recipe"],
+                         name="feeditem_subscriber_idx"),
+            # Очистка ленты при отписке и удаление автора
+            models.Index(fields=["author", "subscriber"],
+                         name="feeditem_author_idx"),
+        ]
+        verbose_name = "Лента"
+        verbose_name_plural = "Ленты"
@@ -0,0 +1,272 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from .models import Recipe, RecipeIngredient
+
+VERSION_KEY = "pantry_index_version"
+REBUILD_KEY = "pantry_index_rebuild"
+
+# Изменения рецептов перечитываются с запасом: транзакция могла
+# записать updated_at раньше, а зафиксироваться позже прошлой сверки
+SYNC_OVERLAP = timedelta(seconds=60)
+
+Matches = namedtuple("Matches", ("recipe_ids", "missing", "coverage"))
+
+IndexState = namedtuple("IndexState", ("base", "alive", "overlay",
+                                       "version", "rebuild", "synced_at",
+                                       "built_at"))
+
+
+class PantryPostings:
+    """
+    Неизменяемый инвертированный индекс ингредиент -> рецепты.
+
+    Рецепты пронумерованы по возрастанию id. Позиции рецептов каждого
+    ингредиента лежат подряд в одном массиве positions
+    (positions[offsets[i]:offsets[i + 1]] для ingredients[i]) и
+    отсортированы, sizes - число ингредиентов рецепта.
+    """
+
+    def __init__(self, ingredient_ids, recipe_ids):
+        ingredient_ids = np.asarray(ingredient_ids, dtype=np.int64)
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        self.recipes, positions = np.unique(recipe_ids, return_inverse=True)
+        self.sizes = np.bincount(
+            positions, minlength=len(self.recipes)
+        ).astype(np.int16)
+        order = np.lexsort((positions, ingredient_ids))
+        self.ingredients, starts = np.unique(ingredient_ids[order],
+                                             return_index=True)
+        self.offsets = np.append(starts, len(order))
+        self.positions = positions[order].astype(np.int32)
+
+    @classmethod
+    def from_db(cls):
+        pairs = np.fromiter(
+            RecipeIngredient.objects.order_by().values_list(
+                "ingredient_id", "recipe_id"
+            ).iterator(chunk_size=10000),
+            dtype=[("ingredient", np.int64), ("recipe", np.int64)],
+        )
+        return cls(pairs["ingredient"], pairs["recipe"])
+
+    def pairs(self, alive):
+        """
+        Пары (ингредиент, рецепт) для рецептов с alive[позиция]
+        """
+        ingredient_ids = np.repeat(self.ingredients, np.diff(self.offsets))
+        keep = alive[self.positions]
+        return (ingredient_ids[keep],
+                self.recipes[self.positions[keep]])
+
+    def match(self, ingredient_ids, max_missing, alive):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов и не
+        хватает не больше max_missing. Вхождения считаются
+        по спискам рецептов выбранных ингредиентов.
+        """
+        hits = np.zeros(len(self.recipes), dtype=np.int16)
+        found = np.searchsorted(self.ingredients, ingredient_ids)
+        for index, ingredient_id in zip(found, ingredient_ids):
+            if (index < len(self.ingredients)
+                    and self.ingredients[index] == ingredient_id):
+                # Позиции в списке не повторяются, поэтому += корректно
+                hits[self.positions[self.offsets[index]:
+                                    self.offsets[index + 1]]] += 1
+        missing = self.sizes - hits
+        positions = np.flatnonzero((hits > 0) & (missing <= max_missing)
+                                   & alive)
+        return Matches(
+            recipe_ids=self.recipes[positions],
+            missing=missing[positions],
+            coverage=hits[positions] / self.sizes[positions],
+        )
+
+
+class PantryIndex:
+    """
+    Поиск рецептов по имеющимся продуктам в памяти процесса.
+
+    Основной индекс строится из RecipeIngredient при первом обращении
+    и раз в PANTRY_INDEX_TTL секунд. Изменённые рецепты попадают
+    в небольшую добавку overlay, а их старые записи в основном индексе
+    отключаются маской alive. Когда добавка вырастает больше
+    PANTRY_INDEX_OVERLAY рецептов, она сливается с основным индексом
+    без обращения к БД.
+
+    Сохранение и удаление рецепта меняют версию в кэше default, и
+    каждый процесс при следующем поиске перечитывает рецепты,
+    изменённые после прошлой сверки. Удаление рецепта другим процессом
+    замечается при загрузке найденных рецептов (discard). Кэш default
+    должен быть общим для всех процессов (DEFAULT_CACHE_BACKEND): с
+    LocMemCache другие процессы увидят изменения только после
+    перестройки через PANTRY_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def match(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты из ingredient_ids, которым не хватает не больше
+        max_missing продуктов: сначала с наибольшей долей имеющихся
+        продуктов, затем с наименьшим числом недостающих, затем новые
+        """
+        return self.match_state(self._get_state(), ingredient_ids,
+                                max_missing)
+
+    @staticmethod
+    def match_state(state, ingredient_ids, max_missing):
+        query = np.unique(np.asarray(ingredient_ids, dtype=np.int64))
+        base = state.base.match(query, max_missing, state.alive)
+
+        chosen = set(query.tolist())
+        extra = [
+            (recipe_id, len(ingredients) - len(ingredients & chosen),
+             len(ingredients & chosen) / len(ingredients))
+            for recipe_id, ingredients in state.overlay.items()
+            if ingredients and ingredients & chosen
+            and len(ingredients - chosen) <= max_missing
+        ]
+        recipe_ids = np.concatenate([
+            base.recipe_ids,
+            np.array([item[0] for item in extra], dtype=np.int64),
+        ])
+        missing = np.concatenate([
+            base.missing, np.array([item[1] for item in extra], np.int16)
+        ])
+        coverage = np.concatenate([
+            base.coverage, np.array([item[2] for item in extra])
+        ])
+        order = np.lexsort((-recipe_ids, missing, -coverage))
+        return Matches(recipe_ids[order], missing[order], coverage[order])
+
+    def discard(self, recipe_ids):
+        """
+        Убирает удалённые рецепты из индекса этого процесса
+        """
+        with self._lock:
+            state = self._state
+            if state is None:
+                return
+            self._state = self.patch(
+                state, {recipe_id: frozenset() for recipe_id in recipe_ids}
+            )
+
+    def invalidate(self, rebuild=False):
+        """
+        Сообщает всем процессам, что рецепты изменились. rebuild - после
+        массовых изменений без сигналов (bulk_create, _raw_delete):
+        индекс перестраивается целиком.
+        """
+        markers = {VERSION_KEY: time.time_ns()}
+        if rebuild:
+            markers[REBUILD_KEY] = markers[VERSION_KEY]
+        cache.set_many(markers, timeout=None)
+
+    def _get_state(self):
+        markers = cache.get_many([VERSION_KEY, REBUILD_KEY])
+        version = markers.get(VERSION_KEY)
+        rebuild = markers.get(REBUILD_KEY)
+        state = self._state
+        if state is not None and not self._is_stale(state, version,
+                                                    rebuild):
+            return state
+        # Пока другой поток обновляет индекс, поиск идёт по прежнему
+        if not self._lock.acquire(blocking=state is None):
+            return state
+        try:
+            state = self._state
+            if (state is None or state.rebuild != rebuild
+                    or self._is_expired(state)):
+                state = self._state = self._build(version, rebuild)
+            elif state.version != version:
+                state = self._state = self._sync(state, version)
+        finally:
+            self._lock.release()
+        return state
+
+    def _is_stale(self, state, version, rebuild):
+        return (state.version != version or state.rebuild != rebuild
+                or self._is_expired(state))
+
+    @staticmethod
+    def _is_expired(state):
+        return (time.monotonic() - state.built_at
+                > settings.PANTRY_INDEX_TTL)
+
+    def _build(self, version, rebuild):
+        synced_at = now()
+        return self.make_state(PantryPostings.from_db(), version, rebuild,
+                               synced_at)
+
+    @staticmethod
+    def make_state(base, version=None, rebuild=None, synced_at=None):
+        return IndexState(base=base,
+                          alive=np.ones(len(base.recipes), dtype=bool),
+                          overlay={}, version=version, rebuild=rebuild,
+                          synced_at=synced_at or now(),
+                          built_at=time.monotonic())
+
+    def _sync(self, state, version):
+        """
+        Перечитывает рецепты, изменённые после прошлой сверки
+        """
+        synced_at = now()
+        changed = {
+            recipe_id: set() for recipe_id in Recipe.objects.filter(
+                updated_at__gte=state.synced_at - SYNC_OVERLAP
+            ).values_list("id", flat=True)
+        }
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=changed
+        ).values_list("recipe_id", "ingredient_id"):
+            changed[recipe_id].add(ingredient_id)
+        state = self.patch(state, {
+            recipe_id: frozenset(ingredients)
+            for recipe_id, ingredients in changed.items()
+        })
+        return state._replace(version=version, synced_at=synced_at)
+
+    @staticmethod
+    def patch(state, changes):
+        """
+        Новое состояние с изменёнными рецептами в добавке. Пустой набор
+        ингредиентов означает удалённый рецепт.
+        """
+        base = state.base
+        alive = state.alive
+        recipe_ids = np.fromiter(changes, dtype=np.int64, count=len(changes))
+        positions = np.searchsorted(base.recipes, recipe_ids)
+        positions = positions[positions < len(base.recipes)]
+        positions = positions[np.isin(base.recipes[positions], recipe_ids)]
+        if len(positions):
+            alive = alive.copy()
+            alive[positions] = False
+        overlay = {**state.overlay, **changes}
+        if len(overlay) <= settings.PANTRY_INDEX_OVERLAY:
+            return state._replace(alive=alive, overlay=overlay)
+
+        ingredient_ids, pair_recipes = base.pairs(alive)
+        added = [(ingredient_id, recipe_id)
+                 for recipe_id, ingredients in overlay.items()
+                 for ingredient_id in ingredients]
+        added = np.array(added, dtype=np.int64).reshape(-1, 2)
+        base = PantryPostings(
+            np.concatenate([ingredient_ids, added[:, 0]]),
+            np.concatenate([pair_recipes, added[:, 1]]),
+        )
+        return state._replace(base=base,
+                              alive=np.ones(len(base.recipes), dtype=bool),
+                              overlay={})
+
+
+pantry_index = PantryIndex()
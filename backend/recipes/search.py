@@ -0,0 +1,198 @@
+import re
+
+from django.db import NotSupportedError
+from django.db.models import BooleanField, Expression, F, FloatField
+
+RECIPE_TABLE = "recipes_recipe"
+
+# PostgreSQL: вычисляемый столбец tsvector с GIN-индексом. Название
+# важнее текста: веса A и B.
+POSTGRES_CONFIG = "russian"
+POSTGRES_COLUMN = "search_vector"
+POSTGRES_INDEX = "recipe_search_idx"
+POSTGRES_VECTOR = (
+    f"setweight(to_tsvector('{POSTGRES_CONFIG}', "
+    f"coalesce(\"name\", '')), 'A') || "
+    f"setweight(to_tsvector('{POSTGRES_CONFIG}', "
+    f"coalesce(\"text\", '')), 'B')"
+)
+
+# SQLite: таблица FTS5 с внешним содержимым, которую обновляют триггеры.
+# Веса столбцов для bm25 в том же отношении, что веса A и B
+# в ts_rank_cd (1.0 и 0.4).
+SQLITE_TABLE = "recipes_recipe_fts"
+SQLITE_WEIGHTS = (2.5, 1.0)
+SQLITE_TRIGGERS = {
+    "insert": (
+        "AFTER INSERT ON {recipes} BEGIN {add}; END"
+    ),
+    "delete": (
+        "AFTER DELETE ON {recipes} BEGIN {remove}; END"
+    ),
+    "update": (
+        "AFTER UPDATE OF name, text ON {recipes} "
+        "WHEN old.name IS NOT new.name OR old.text IS NOT new.text "
+        "BEGIN {remove}; {add}; END"
+    ),
+}
+
+TERM = re.compile(r"\w+")
+
+
+def install_search_index(schema_editor):
+    """
+    Создаёт поисковый индекс рецептов и заполняет его. Повторный вызов
+    ничего не ломает: так индекс восстанавливает rebuild_search_index.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            f'ALTER TABLE "{RECIPE_TABLE}" ADD COLUMN IF NOT EXISTS '
+            f'"{POSTGRES_COLUMN}" tsvector '
+            f"GENERATED ALWAYS AS ({POSTGRES_VECTOR}) STORED"
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{POSTGRES_INDEX}" '
+            f'ON "{RECIPE_TABLE}" USING gin ("{POSTGRES_COLUMN}")'
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{SQLITE_TABLE}" '
+            f"USING fts5(name, text, content='{RECIPE_TABLE}', "
+            f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        add = (f'INSERT INTO "{SQLITE_TABLE}" (rowid, name, text) '
+               f"VALUES (new.id, new.name, new.text)")
+        remove = (f'INSERT INTO "{SQLITE_TABLE}" '
+                  f'("{SQLITE_TABLE}", rowid, name, text) '
+                  f"VALUES ('delete', old.id, old.name, old.text)")
+        for event, body in SQLITE_TRIGGERS.items():
+            # Django пересоздаёт таблицу при части изменений схемы
+            # в SQLite, и триггеры старой таблицы пропадают
+            schema_editor.execute(
+                f'DROP TRIGGER IF EXISTS "{SQLITE_TABLE}_{event}"'
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER "{SQLITE_TABLE}_{event}" '
+                + body.format(recipes=f'"{RECIPE_TABLE}"', add=add,
+                              remove=remove)
+            )
+        schema_editor.execute(
+            f'INSERT INTO "{SQLITE_TABLE}" ("{SQLITE_TABLE}") '
+            f"VALUES ('rebuild')"
+        )
+    else:
+        raise NotSupportedError(
+            f"Полнотекстовый поиск не поддерживается для {vendor}"
+        )
+
+
+def drop_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            f'ALTER TABLE "{RECIPE_TABLE}" '
+            f'DROP COLUMN IF EXISTS "{POSTGRES_COLUMN}"'
+        )
+    elif vendor == "sqlite":
+        for event in SQLITE_TRIGGERS:
+            schema_editor.execute(
+                f'DROP TRIGGER IF EXISTS "{SQLITE_TABLE}_{event}"'
+            )
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{SQLITE_TABLE}"')
+
+
+def sqlite_query(query):
+    """
+    Запрос FTS5 из слов пользовательской строки: каждое слово
+    в кавычках (спецсимволы FTS5 не разбираются) и ищется как начало
+    слова, потому что unicode61 не приводит слова к основе
+    """
+    return " ".join(f'"{term}"*' for term in TERM.findall(query))
+
+
+class RecipeSearchExpression(Expression):
+    """
+    Выражение над поисковым индексом рецепта. Индекс не описан в модели,
+    поэтому SQL собирается для каждой СУБД отдельно из ссылки на pk.
+    """
+
+    def __init__(self, query):
+        super().__init__()
+        self.query = query
+        self.pk = F("pk")
+
+    def get_source_expressions(self):
+        return [self.pk]
+
+    def set_source_expressions(self, exprs):
+        self.pk, = exprs
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError(
+            f"Полнотекстовый поиск не поддерживается для {connection.vendor}"
+        )
+
+    def postgres_vector(self, compiler):
+        return (f"{compiler.quote_name_unless_alias(self.pk.alias)}."
+                f'"{POSTGRES_COLUMN}"')
+
+
+class SearchMatch(RecipeSearchExpression):
+    """
+    Условие: рецепт подходит под запрос
+    """
+    output_field = BooleanField()
+
+    def as_postgresql(self, compiler, connection):
+        return (f"{self.postgres_vector(compiler)} @@ "
+                f"websearch_to_tsquery(%s::regconfig, %s)",
+                [POSTGRES_CONFIG, self.query])
+
+    def as_sqlite(self, compiler, connection):
+        pk, params = compiler.compile(self.pk)
+        return (f'{pk} IN (SELECT rowid FROM "{SQLITE_TABLE}" '
+                f'WHERE "{SQLITE_TABLE}" MATCH %s)',
+                [*params, sqlite_query(self.query)])
+
+
+class SearchRank(RecipeSearchExpression):
+    """
+    Релевантность рецепта запросу: чем больше, тем выше в выдаче
+    """
+    output_field = FloatField()
+
+    def as_postgresql(self, compiler, connection):
+        return (f"ts_rank_cd({self.postgres_vector(compiler)}, "
+                f"websearch_to_tsquery(%s::regconfig, %s))",
+                [POSTGRES_CONFIG, self.query])
+
+    def as_sqlite(self, compiler, connection):
+        # bm25 тем меньше, чем документ релевантнее. Коррелированный
+        # подзапрос с MATCH заново считал бы статистику индекса для
+        # каждого рецепта, поэтому релевантности всех найденных рецептов
+        # вычисляются один раз в материализованном CTE.
+        pk, params = compiler.compile(self.pk)
+        weights = ", ".join(map(str, SQLITE_WEIGHTS))
+        return (f"(WITH ranks AS MATERIALIZED ("
+                f'SELECT rowid AS id, -bm25("{SQLITE_TABLE}", {weights}) '
+                f'AS rank FROM "{SQLITE_TABLE}" '
+                f'WHERE "{SQLITE_TABLE}" MATCH %s) '
+                f"SELECT rank FROM ranks WHERE ranks.id = {pk})",
+                [sqlite_query(self.query), *params])
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, подходящие под запрос. Строка без слов ничего не находит.
+    """
+    if not TERM.search(query):
+        return queryset.none()
+    return queryset.filter(SearchMatch(query))
+
+
+def rank_recipes(queryset, query):
+    """
+    Добавляет релевантность search_rank
+    """
+    return queryset.annotate(search_rank=SearchRank(query))
@@ -0,0 +1,168 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from . import counters, feed
+from .cooking_time import invalidate_tertiles
+from .images import schedule_variants
+from .ingredient_index import ingredient_index
+from .models import Favourite, FoodgramUser, Ingredient, Recipe, Subscriber
+from .pantry_index import pantry_index
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сброс индекса ингредиентов после изменения"""
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_on_ingredient(sender, instance, created=False, **kwargs):
+    """Рецепты с изменённым продуктом считаются изменёнными"""
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update(updated_at=now())
+
+
+@receiver(post_save, sender=FoodgramUser)
+def touch_recipes_on_author(sender, instance, created, update_fields,
+                            **kwargs):
+    """Рецепты автора с изменённым профилем считаются изменёнными"""
+    if created or (update_fields is not None
+                   and set(update_fields) <= {"last_login"}):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=now())
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_cooking_time_tertiles(sender, **kwargs):
+    """Сброс кэша границ фильтра по времени готовки"""
+    transaction.on_commit(invalidate_tertiles)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_pantry_index(sender, **kwargs):
+    """Индексы продуктов во всех процессах перечитают рецепты"""
+    transaction.on_commit(pantry_index.invalidate)
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_from_pantry_index(sender, instance, **kwargs):
+    """Удалённый рецепт сразу пропадает из индекса продуктов"""
+    transaction.on_commit(partial(pantry_index.discard, [instance.pk]))
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_image_variants(sender, instance, **kwargs):
+    """Создание уменьшенных копий нового изображения рецепта"""
+    schedule_variants(instance, "image", "image_variants")
+
+
+@receiver(post_save, sender=FoodgramUser)
+def schedule_avatar_variants(sender, instance, **kwargs):
+    """Создание уменьшенных копий новой аватарки"""
+    schedule_variants(instance, "avatar", "avatar_variants")
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, raw, **kwargs):
+    """Новый рецепт попадает в ленты подписчиков автора"""
+    if created and not raw:
+        feed.fan_out(instance)
+
+
+@receiver(post_save, sender=Subscriber)
+def backfill_feed(sender, instance, created, raw, **kwargs):
+    """После подписки в ленте появляются последние рецепты автора"""
+    if created and not raw:
+        feed.backfill(instance.subscriber_id, instance.publisher_id)
+
+
+@receiver(post_delete, sender=Subscriber)
+def clean_feed(sender, instance, origin=None, **kwargs):
+    """После отписки рецепты автора убираются из ленты"""
+    deleted = getattr(origin, "_deleted_targets", set())
+    # Ленту удалённого пользователя удаляет каскад
+    if deleted.isdisjoint({(FoodgramUser, instance.subscriber_id),
+                           (FoodgramUser, instance.publisher_id)}):
+        feed.remove(instance.subscriber_id, instance.publisher_id)
+
+
+def counted_fields(sender):
+    return [sender._meta.get_field(counter.field)
+            for counter in counters.counters_for(sender)]
+
+
+@receiver(pre_save, sender=Favourite)
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Subscriber)
+def remember_counted_relations(sender, instance, raw, update_fields,
+                               **kwargs):
+    """Запоминает прежние связи, если объект могут перепривязать"""
+    fields = counted_fields(sender)
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not any(
+        field.name in update_fields or field.attname in update_fields
+        for field in fields
+    ):
+        return
+    instance._counted_relations = sender.objects.filter(
+        pk=instance.pk
+    ).values(*(field.attname for field in fields)).first()
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscriber)
+def increment_counters(sender, instance, created, raw, **kwargs):
+    """Увеличивает счётчики объектов, на которые ссылается новая запись"""
+    if raw:
+        return
+    old = instance.__dict__.pop("_counted_relations", None)
+    for counter, field in zip(counters.counters_for(sender),
+                              counted_fields(sender)):
+        new_id = getattr(instance, field.attname)
+        if created:
+            counters.adjust(counter, new_id, 1)
+        elif old is not None and old[field.attname] != new_id:
+            counters.adjust(counter, old[field.attname], -1)
+            counters.adjust(counter, new_id, 1)
+
+
+@receiver(pre_delete, sender=Recipe)
+@receiver(pre_delete, sender=FoodgramUser)
+def remember_deleted_targets(sender, instance, origin=None, **kwargs):
+    """
+    Запоминает в объекте, с которого начато удаление, все удаляемые
+    каскадом рецепты и пользователи: их счётчики обновлять не нужно
+    """
+    if origin is not None:
+        if not hasattr(origin, "_deleted_targets"):
+            origin._deleted_targets = set()
+        origin._deleted_targets.add((sender, instance.pk))
+
+
+@receiver(post_delete, sender=Favourite)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscriber)
+def decrement_counters(sender, instance, origin=None, **kwargs):
+    """
+    Уменьшает счётчики. Срабатывает и при удалении через QuerySet.delete()
+    и каскадом: для моделей с обработчиками post_delete Django удаляет
+    объекты по одному сигналу на каждый.
+    """
+    deleted = getattr(origin, "_deleted_targets", ())
+    for counter, field in zip(counters.counters_for(sender),
+                              counted_fields(sender)):
+        target_id = getattr(instance, field.attname)
+        if (field.related_model, target_id) not in deleted:
+            counters.adjust(counter, target_id, -1)
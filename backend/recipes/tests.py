@@ -0,0 +1,82 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from .cooking_time import compute_tertiles
+from .models import FoodgramUser, Ingredient, Recipe
+
+
+class ImportIngredientsTests(TestCase):
+
+    def import_rows(self, rows, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "ingredients.json"
+            path.write_text(json.dumps(rows), encoding="utf-8")
+            call_command("import_ingredients", str(path), *args,
+                         stdout=StringIO())
+
+    def test_existing_names_matched_after_normalization(self):
+        # Строки, сохранённые до нормализации названий при импорте
+        Ingredient.objects.create(name="Сахар", measurement_unit="г")
+        Ingredient.objects.create(name="Соль  поваренная",
+                                  measurement_unit="г")
+        self.import_rows([
+            {"name": "сахар", "measurement_unit": "г"},
+            {"name": "СОЛЬ поваренная", "measurement_unit": "кг"},
+        ], "--update-units")
+        self.assertEqual(
+            list(Ingredient.objects.order_by("pk").values_list(
+                "name", "measurement_unit"
+            )),
+            [("Сахар", "г"), ("Соль  поваренная", "кг")],
+        )
+
+
+class CookingTimeTertilesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = FoodgramUser.objects.create_user(
+            email="author@test.ru", username="author", first_name="Имя",
+            last_name="Фамилия", password="test-Pa55word",
+        )
+
+    def create_recipes(self, times):
+        Recipe.objects.all().delete()
+        Recipe.objects.bulk_create(
+            Recipe(author=self.author, name=f"Рецепт {i}", text="Текст",
+                   cooking_time=time, image="recipes/test.png")
+            for i, time in enumerate(times)
+        )
+
+    @staticmethod
+    def python_tertiles(times):
+        """
+        Прежний расчёт фильтра админки в Python
+        """
+        times = sorted(times)
+        n = times[len(times) // 3]
+        m = times[2 * len(times) // 3]
+        return (n, m, sum(time < n for time in times),
+                sum(n <= time < m for time in times),
+                sum(time >= m for time in times))
+
+    def test_six_recipes_split_evenly(self):
+        self.create_recipes(range(1, 7))
+        tertiles = compute_tertiles()
+        self.assertEqual(tuple(tertiles)[:5], (3, 5, 2, 2, 2))
+
+    def test_matches_python_calculation(self):
+        for times in ([1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6, 7],
+                      [1, 2, 3, 4, 5, 6, 7, 8], [5, 1, 5, 10, 1, 30, 5],
+                      [2, 2, 2, 3, 40, 40, 40, 41, 90]):
+            with self.subTest(times=times):
+                self.create_recipes(times)
+                tertiles = compute_tertiles()
+                self.assertEqual(tuple(tertiles)[:5],
+                                 self.python_tertiles(times))
+                self.assertEqual(tertiles.distinct, len(set(times)))
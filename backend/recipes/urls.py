@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from .views import redirect_shorturl
+from .views import aredirect_shorturl, redirect_shorturl
 
 app_name = "recipes"
 
 urlpatterns = [
-    path("<int:recipe_id>/", redirect_shorturl, name="short-link-redirect"),
+    path("<int:recipe_id>/",
+         aredirect_shorturl if settings.ASYNC_READ_VIEWS
+         else redirect_shorturl,
+         name="short-link-redirect"),
 ]
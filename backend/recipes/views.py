@@ -10,3 +10,11 @@ def redirect_shorturl(request, recipe_id):
         raise Http404(f"Рецепт {recipe_id} не найден")
 
     return redirect(f'/recipes/{recipe_id}')
+
+
+async def aredirect_shorturl(request, recipe_id):
+    """Перенаправление с короткой ссылки для ASGI-сервера"""
+    if not await Recipe.objects.filter(pk=recipe_id).aexists():
+        raise Http404(f"Рецепт {recipe_id} не найден")
+
+    return redirect(f'/recipes/{recipe_id}')
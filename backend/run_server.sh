@@ -9,4 +9,10 @@ done;
 python ./manage.py migrate;
 python ./manage.py import_ingredients;
 python ./manage.py collectstatic --noinput;
-gunicorn -w 2 -b 0:8000 foodgram_backend.wsgi;
+case "$ASYNC_READ_VIEWS" in
+    [Tt]rue|1|[Yy]es|[Oo]n)
+        uvicorn foodgram_backend.asgi:application --workers 2 \
+            --host 0.0.0.0 --port 8000;;
+    *)
+        gunicorn -w 2 -b 0:8000 foodgram_backend.wsgi;;
+esac